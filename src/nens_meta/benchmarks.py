@@ -0,0 +1,181 @@
+"""Purpose: microbenchmarks for the helpers that run per file and per repo
+
+End-to-end timings tell you *that* something got slower, these tell you *what*.
+Every benchmark measures one function on a representative (large-ish) input. The
+best time per call is compared against a baseline JSON file that is committed to
+the repo; a benchmark that is more than the threshold slower is a regression.
+
+Timings depend on the machine, so update the baseline (`--update`) on the machine
+you compare on. The default baseline is the one in nens-meta's own checkout, not in
+the current directory.
+"""
+
+import json
+import logging
+import timeit
+from collections.abc import Callable
+from pathlib import Path
+
+from nens_meta import (
+    __version__,
+    filesystem,
+    nens_toml,
+    pyproject_toml,
+    utils,
+)
+
+SOURCE_DIR = Path(__file__).parents[2]
+DEFAULT_BASELINE = SOURCE_DIR / "benchmarks.json"
+DEFAULT_THRESHOLD = 0.25
+REPEAT = 5
+PROJECT = Path("/project")
+
+logger = logging.getLogger(__name__)
+
+
+def _project() -> nens_toml.OurConfig:
+    fs = filesystem.MemoryFilesystem(
+        {
+            nens_toml.nens_toml_file(PROJECT): (
+                f'[meta]\nmeta_version = "{__version__}"\nproject_name = "example"\n'
+                "uses_python = true\nuses_ansible = true\n"
+                '[meta_workflow]\npython_version = "3.12"\n'
+            ),
+            PROJECT / "src" / "example" / "__init__.py": "",
+        }
+    )
+    return nens_toml.OurConfig(PROJECT, fs=fs)
+
+
+def _extra_lines(number: int) -> str:
+    return "".join(f"/extra/line/{line}\n" for line in range(number))
+
+
+def bench_strip_whitespace() -> Callable:
+    rendered = "".join(f"line {line}   \n\n" for line in range(5000)) + "\n" * 100
+    return lambda: utils.strip_whitespace(rendered)
+
+
+def bench_extract_extra_lines() -> Callable:
+    content = "generated\n" * 200 + utils.EXTRA_LINES_MARKER + _extra_lines(5000)
+    return lambda: utils._extract_extra_lines(content)
+
+
+def bench_write_if_changed() -> Callable:
+    desired = "".join(f"/generated/{line}\n" for line in range(200))
+    target = PROJECT / ".gitignore"
+    existing = desired + "\n" + utils.EXTRA_LINES_MARKER + _extra_lines(5000)
+    fs = filesystem.MemoryFilesystem({target: existing})
+    # Unchanged: the common case.
+    return lambda: utils.write_if_changed(target, desired, fs=fs)
+
+
+def bench_section_options() -> Callable:
+    our_config = _project()
+
+    def section_options() -> dict:
+        # Validate and merge every time instead of measuring a cache hit.
+        our_config.defaults = nens_toml.Defaults({})
+        our_config._validated_hash = None
+        return our_config.section_options("meta_workflow")
+
+    return section_options
+
+
+def bench_get_or_create_section() -> Callable:
+    depth = 8
+    lines = []
+    for level in range(1, depth + 1):
+        name = ".".join(f"level{number}" for number in range(level))
+        lines += [f"[{name}]", *(f"key{key} = {key}" for key in range(20)), ""]
+    fs = filesystem.MemoryFilesystem(
+        {pyproject_toml.pyproject_toml_file(PROJECT): "\n".join(lines)}
+    )
+    project_config = pyproject_toml.PyprojectToml(PROJECT, {}, fs)
+    deepest = ".".join(f"level{number}" for number in range(depth))
+    return lambda: project_config.get_or_create_section(deepest)
+
+
+def _bench_content(templated_file_class: type) -> Callable[[], Callable]:
+    def bench() -> Callable:
+        our_config = _project()
+        # .content is cached on the instance, so use a fresh one every time.
+        return lambda: templated_file_class(PROJECT, our_config).content
+
+    return bench
+
+
+HELPER_BENCHMARKS: dict[str, Callable[[], Callable]] = {
+    "strip_whitespace": bench_strip_whitespace,
+    "extract_extra_lines": bench_extract_extra_lines,
+    "write_if_changed": bench_write_if_changed,
+    "section_options": bench_section_options,
+    "get_or_create_section": bench_get_or_create_section,
+}
+
+
+def all_benchmarks() -> dict[str, Callable[[], Callable]]:
+    """Return the helper benchmarks plus one per template"""
+    # Imported here as update_project imports us for its command line.
+    from nens_meta import update_project
+
+    return HELPER_BENCHMARKS | {
+        f"content:{generated_file.name}": _bench_content(
+            generated_file.templated_file_class
+        )
+        for generated_file in update_project.GENERATED_FILES
+        if generated_file.templated_file_class
+    }
+
+
+def run(names: list[str] | None = None, repeat: int = REPEAT) -> dict[str, float]:
+    """Return the best time per call (in seconds) of the benchmarks"""
+    available = all_benchmarks()
+    results = {}
+    for name in names or available:
+        timer = timeit.Timer(available[name]())
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number))
+        results[name] = best / number
+        logger.debug(f"{name}: {results[name] * 1_000_000:.1f} µs")
+    return results
+
+
+def in_source_checkout() -> bool:
+    """Return whether nens-meta runs from its source checkout (with the baseline)"""
+    return (SOURCE_DIR / "pyproject.toml").exists() and (
+        SOURCE_DIR / "src" / "nens_meta"
+    ).is_dir()
+
+
+def load_baseline(baseline_file: Path) -> dict[str, float]:
+    if not baseline_file.exists():
+        return {}
+    return json.loads(baseline_file.read_text())
+
+
+def save_baseline(baseline_file: Path, results: dict[str, float]):
+    baseline_file.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+
+
+def compare(
+    results: dict[str, float],
+    baseline: dict[str, float],
+    threshold: float = DEFAULT_THRESHOLD,
+) -> list[str]:
+    """Return the regressions: benchmarks more than `threshold` slower"""
+    regressions = []
+    for name, seconds in results.items():
+        if name not in baseline:
+            logger.info(f"{name}: not in the baseline yet")
+            continue
+        ratio = seconds / baseline[name]
+        message = (
+            f"{name}: {seconds * 1_000_000:.1f} µs, "
+            f"{ratio:.2f}x the baseline ({baseline[name] * 1_000_000:.1f} µs)"
+        )
+        if ratio > 1 + threshold:
+            regressions.append(message)
+        else:
+            logger.info(message)
+    return regressions
@@ -0,0 +1,124 @@
+"""Purpose: collect all file changes first and write them in one go"""
+
+import logging
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+from nens_meta import filesystem, utils
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Change:
+    target: Path
+    content: str
+
+
+class ChangeSet:
+    """Set of files to write, applied as one batch
+
+    Everything (.nens.toml, pyproject.toml, the templated files) is first rendered
+    and added here. Only when all of that succeeded, `apply()` writes the files. If
+    writing fails halfway, the files that were already written are restored.
+    """
+
+    changes: list[Change]
+    fs: filesystem.Filesystem
+
+    def __init__(self, fs: filesystem.Filesystem = filesystem.DISK):
+        self.changes = []
+        self.fs = fs
+
+    def __bool__(self) -> bool:
+        return bool(self.changes)
+
+    def __len__(self) -> int:
+        return len(self.changes)
+
+    def add(
+        self,
+        target: Path,
+        desired_content: str,
+        handle_extra_lines=True,
+        check_duplicates=False,
+        drop_duplicates=False,
+    ):
+        """Add the file to the change set if its content would change
+
+        Adding the same target twice replaces the earlier change, also when it was
+        planned as a `.suggestion` file. See `utils.planned_write()` for the other
+        arguments.
+        """
+        planned = utils.planned_write(
+            target,
+            desired_content,
+            handle_extra_lines,
+            self.fs,
+            check_duplicates=check_duplicates,
+            drop_duplicates=drop_duplicates,
+        )
+        replaced = {target, target.parent / (target.name + utils.SUGGESTION_SUFFIX)}
+        self.changes = [
+            change for change in self.changes if change.target not in replaced
+        ]
+        if planned is None:
+            return
+        target, content = planned
+        self.changes.append(Change(target=target, content=content))
+        logger.debug(f"Staged {target}")
+
+    def apply(self):
+        """Write all changes, rolling back the already-written ones upon errors
+
+        Only writes to the real disk are logged as info: in-memory runs (like
+        `patches` and `audit`) would otherwise report writes that didn't happen.
+        """
+        log = logger.info if self.fs is filesystem.DISK else logger.debug
+        originals: list[tuple[Path, str | None]] = []
+        created_dirs: list[Path] = []
+        try:
+            for change in self.changes:
+                for directory in _create_missing_dirs(self.fs, change.target.parent):
+                    # Recorded right away: a later mkdir might fail.
+                    created_dirs.append(directory)
+                    log(f"Created directory {directory}")
+                target = change.target
+                exists = self.fs.exists(target)
+                originals.append(
+                    (target, self.fs.read_text(target) if exists else None)
+                )
+                self.fs.write_text(target, change.content)
+                log(f"Wrote {target}")
+        except Exception:
+            logger.error("Writing the changes failed, rolling back")
+            _rollback(self.fs, originals, created_dirs)
+            raise
+
+
+def _create_missing_dirs(fs: filesystem.Filesystem, directory: Path) -> Iterator[Path]:
+    """Create directory (and its parents), yield each one once it is created"""
+    missing = []
+    while not fs.exists(directory):
+        missing.append(directory)
+        directory = directory.parent
+    missing.reverse()
+    for to_create in missing:
+        fs.mkdir(to_create)
+        yield to_create
+
+
+def _rollback(
+    fs: filesystem.Filesystem,
+    originals: list[tuple[Path, str | None]],
+    created_dirs: list[Path],
+):
+    for target, original in reversed(originals):
+        if original is None:
+            fs.unlink(target)
+        else:
+            fs.write_text(target, original)
+        logger.info(f"Restored {target}")
+    for directory in reversed(created_dirs):
+        fs.rmdir(directory)
@@ -0,0 +1,251 @@
+"""Purpose: route all file access through a (replaceable) filesystem
+
+Normally we work on the real disk (`DISK`). `MemoryFilesystem` keeps everything in
+memory, handy for generating project skeletons in bulk and for tests.
+`OverlayFilesystem` reads from another filesystem, but keeps all changes in memory:
+the original files are left alone.
+"""
+
+import fnmatch
+import io
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from pathlib import Path
+
+from nens_meta import git_index
+
+
+class Filesystem(ABC):
+    """Interface for the file operations nens-meta needs"""
+
+    @abstractmethod
+    def exists(self, path: Path) -> bool:
+        """Return whether the file or directory exists"""
+
+    @abstractmethod
+    def is_dir(self, path: Path) -> bool:
+        """Return whether the path is an existing directory"""
+
+    @abstractmethod
+    def read_text(self, path: Path) -> str:
+        """Return the file's contents"""
+
+    @abstractmethod
+    def iter_lines(self, path: Path) -> Iterator[str]:
+        """Return the file's lines one by one, without reading it completely"""
+
+    @abstractmethod
+    def write_text(self, path: Path, content: str):
+        """Write the content to the file (the directory must exist)"""
+
+    @abstractmethod
+    def unlink(self, path: Path):
+        """Remove the file, if it exists"""
+
+    @abstractmethod
+    def mkdir(self, path: Path):
+        """Create the directory (its parent must exist)"""
+
+    @abstractmethod
+    def rmdir(self, path: Path):
+        """Remove the (empty) directory"""
+
+    @abstractmethod
+    def glob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        """Return files directly inside the directory matching the pattern"""
+
+    @abstractmethod
+    def rglob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        """Return files anywhere below the directory matching the pattern"""
+
+    def known_to_contain(self, path: Path, content: str) -> bool:
+        """Return True if we know (cheaply) that the file has exactly this content
+
+        False means "unknown": the file has to be read to find out.
+        """
+        return False
+
+
+class DiskFilesystem(Filesystem):
+    """The real filesystem, via pathlib"""
+
+    def exists(self, path: Path) -> bool:
+        return path.exists()
+
+    def is_dir(self, path: Path) -> bool:
+        return path.is_dir()
+
+    def read_text(self, path: Path) -> str:
+        return path.read_text()
+
+    def iter_lines(self, path: Path) -> Iterator[str]:
+        with path.open() as f:
+            yield from f
+
+    def write_text(self, path: Path, content: str):
+        path.write_text(content)
+
+    def unlink(self, path: Path):
+        path.unlink(missing_ok=True)
+
+    def mkdir(self, path: Path):
+        path.mkdir()
+
+    def rmdir(self, path: Path):
+        path.rmdir()
+
+    def glob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        return directory.glob(pattern)
+
+    def rglob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        return directory.rglob(pattern)
+
+    def known_to_contain(self, path: Path, content: str) -> bool:
+        return git_index.is_unchanged(path, content)
+
+
+class MemoryFilesystem(Filesystem):
+    """Filesystem that only lives in memory
+
+    Directories are created implicitly when writing a file.
+    """
+
+    files: dict[Path, str]
+    dirs: set[Path]
+
+    def __init__(self, files: dict[Path, str] | None = None):
+        self.files = {}
+        self.dirs = set()
+        for path, content in (files or {}).items():
+            self.write_text(path, content)
+
+    def exists(self, path: Path) -> bool:
+        return path in self.files or self.is_dir(path)
+
+    def is_dir(self, path: Path) -> bool:
+        # "." and "/" always exist.
+        return path in self.dirs or path == path.parent
+
+    def read_text(self, path: Path) -> str:
+        try:
+            return self.files[path]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def iter_lines(self, path: Path) -> Iterator[str]:
+        return iter(io.StringIO(self.read_text(path)))
+
+    def write_text(self, path: Path, content: str):
+        if self.is_dir(path):
+            raise IsADirectoryError(path)
+        self.dirs.update(parent for parent in path.parents if parent != parent.parent)
+        self.files[path] = content
+
+    def unlink(self, path: Path):
+        self.files.pop(path, None)
+
+    def mkdir(self, path: Path):
+        if self.exists(path):
+            raise FileExistsError(path)
+        self.dirs.add(path)
+
+    def rmdir(self, path: Path):
+        if any(path in other.parents for other in self.files.keys() | self.dirs):
+            raise OSError(f"Directory not empty: {path}")
+        self.dirs.discard(path)
+
+    def glob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        for path in sorted(self.files):
+            if path.parent == directory and fnmatch.fnmatch(path.name, pattern):
+                yield path
+
+    def rglob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        for path in sorted(self.files):
+            if directory in path.parents and fnmatch.fnmatch(path.name, pattern):
+                yield path
+
+
+class OverlayFilesystem(Filesystem):
+    """Read from a base filesystem, but keep all changes in memory"""
+
+    base: Filesystem
+    upper: MemoryFilesystem
+    deleted: set[Path]
+
+    def __init__(self, base: Filesystem):
+        self.base = base
+        self.upper = MemoryFilesystem()
+        self.deleted = set()
+
+    def exists(self, path: Path) -> bool:
+        if self.upper.exists(path):
+            return True
+        return path not in self.deleted and self.base.exists(path)
+
+    def is_dir(self, path: Path) -> bool:
+        if self.upper.is_dir(path):
+            return True
+        return path not in self.deleted and self.base.is_dir(path)
+
+    def read_text(self, path: Path) -> str:
+        if path in self.upper.files:
+            return self.upper.read_text(path)
+        if path in self.deleted:
+            raise FileNotFoundError(path)
+        return self.base.read_text(path)
+
+    def iter_lines(self, path: Path) -> Iterator[str]:
+        if path in self.upper.files:
+            return self.upper.iter_lines(path)
+        if path in self.deleted:
+            raise FileNotFoundError(path)
+        return self.base.iter_lines(path)
+
+    def write_text(self, path: Path, content: str):
+        self.deleted.discard(path)
+        self.upper.write_text(path, content)
+
+    def unlink(self, path: Path):
+        self.upper.unlink(path)
+        self.deleted.add(path)
+
+    def mkdir(self, path: Path):
+        if self.exists(path):
+            raise FileExistsError(path)
+        self.deleted.discard(path)
+        self.upper.mkdir(path)
+
+    def rmdir(self, path: Path):
+        self.upper.rmdir(path)
+        self.deleted.add(path)
+
+    def glob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        return self._merged(
+            self.base.glob(directory, pattern), self.upper.glob(directory, pattern)
+        )
+
+    def rglob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        return self._merged(
+            self.base.rglob(directory, pattern), self.upper.rglob(directory, pattern)
+        )
+
+    def _merged(self, from_base: Iterator[Path], from_upper: Iterator[Path]):
+        seen = set()
+        for path in from_upper:
+            seen.add(path)
+            yield path
+        for path in from_base:
+            if path not in seen and path not in self.deleted:
+                yield path
+
+    def known_to_contain(self, path: Path, content: str) -> bool:
+        if path in self.upper.files or path in self.deleted:
+            return False
+        return self.base.known_to_contain(path, content)
+
+    def changed_files(self) -> dict[Path, str]:
+        """Return the files written to the overlay"""
+        return dict(self.upper.files)
+
+
+DISK = DiskFilesystem()
@@ -0,0 +1,222 @@
+"""Purpose: keep a local sqlite index of the .nens.toml settings of lots of repos
+
+Re-indexing only looks at repos whose .nens.toml or generated files changed (based
+on their mtimes). Questions like "which repos still use python 3.11" are then a
+quick query instead of a sweep over all the repos.
+"""
+
+import json
+import logging
+import sqlite3
+import time
+import tomllib
+from pathlib import Path
+
+from nens_meta import git_index, nens_toml, utils
+
+DEFAULT_DB = Path.home() / ".cache" / "nens-meta" / "fleet.sqlite3"
+DB_ENVVAR = "NENS_META_INDEX_DB"
+INDEXED_OPTIONS = {
+    "meta": ["meta_version", "project_name", "uses_python", "uses_ansible"],
+    "meta_workflow": ["python_version", "run_pytest"],
+}
+SCHEMA = """
+create table if not exists repos (
+    path text primary key,
+    project_name text,
+    meta_version text,
+    uses_python integer,
+    uses_ansible integer,
+    python_version text,
+    run_pytest integer,
+    fingerprint text,
+    indexed_at real,
+    last_run_seconds real
+);
+create table if not exists generated_files (
+    repo text,
+    target text,
+    blob_hash text,
+    primary key (repo, target)
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(
+    repo: Path,
+    targets: list[str],
+    defaults: nens_toml.Defaults = nens_toml.NO_DEFAULTS,
+) -> str:
+    """Return mtimes and sizes of .nens.toml and the generated files
+
+    The shared defaults are included, as they influence the indexed values.
+    """
+    stats = {}
+    for name in [nens_toml.META_FILENAME] + targets:
+        path = repo / name
+        if path.exists():
+            stat = path.stat()
+            stats[name] = [stat.st_mtime_ns, stat.st_size]
+    return json.dumps(
+        {"files": stats, "defaults": defaults.sections}, sort_keys=True, default=str
+    )
+
+
+def stored_options(repo: Path, defaults: nens_toml.Defaults) -> dict:
+    """Return the indexed options as found in the repo's .nens.toml
+
+    `OurConfig` isn't used: it fills in [meta] with what we detect, like *our*
+    meta_version instead of the one the repo was last updated with.
+    """
+    contents = tomllib.loads(nens_toml.nens_toml_file(repo).read_text())
+    errors = nens_toml.validate(contents)
+    if errors:
+        raise nens_toml.ValidationError(errors)
+    values = {}
+    for section_name, keys in INDEXED_OPTIONS.items():
+        section = contents.get(section_name, {})
+        options = nens_toml.SCHEMA[section_name].options
+        for key in keys:
+            if key in section:
+                values[key] = section[key]
+            else:
+                values[key] = defaults.get(section_name, options[key])
+    return values
+
+
+def parse_condition(condition: str) -> tuple[str, str | bool]:
+    """Return column and value from "key=value", with true/false as booleans"""
+    column, separator, value = condition.partition("=")
+    if not separator:
+        raise ValueError(f"Condition {condition} should look like key=value")
+    column, value = column.strip(), value.strip()
+    if value.lower() in ("true", "false"):
+        return column, value.lower() == "true"
+    return column, value
+
+
+class FleetIndex:
+    """Wrapper around the sqlite database"""
+
+    db_file: Path
+    connection: sqlite3.Connection
+
+    def __init__(self, db_file: Path):
+        self.db_file = db_file
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(db_file)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def stored_fingerprint(self, repo: Path) -> str | None:
+        row = self.connection.execute(
+            "select fingerprint from repos where path = ?", [str(repo)]
+        ).fetchone()
+        return row["fingerprint"] if row else None
+
+    def update(
+        self,
+        repo: Path,
+        targets: list[str],
+        defaults: nens_toml.Defaults = nens_toml.NO_DEFAULTS,
+    ) -> bool:
+        """Index the repo if it changed since the last time, return whether it did"""
+        repo = repo.absolute()
+        current_fingerprint = fingerprint(repo, targets, defaults)
+        if current_fingerprint == self.stored_fingerprint(repo):
+            logger.debug(f"{repo} unchanged, not re-indexing")
+            return False
+        if not nens_toml.nens_toml_file(repo).exists():
+            logger.warning(f"{repo} has no {nens_toml.META_FILENAME}, skipping")
+            return False
+
+        values = stored_options(repo, defaults)
+        with self.connection:
+            self.connection.execute(
+                """
+                insert into repos (
+                    path, project_name, meta_version, uses_python, uses_ansible,
+                    python_version, run_pytest, fingerprint, indexed_at
+                ) values (
+                    :path, :project_name, :meta_version, :uses_python, :uses_ansible,
+                    :python_version, :run_pytest, :fingerprint, :indexed_at
+                )
+                on conflict (path) do update set
+                    project_name = excluded.project_name,
+                    meta_version = excluded.meta_version,
+                    uses_python = excluded.uses_python,
+                    uses_ansible = excluded.uses_ansible,
+                    python_version = excluded.python_version,
+                    run_pytest = excluded.run_pytest,
+                    fingerprint = excluded.fingerprint,
+                    indexed_at = excluded.indexed_at
+                """,
+                {
+                    **values,
+                    "path": str(repo),
+                    "fingerprint": current_fingerprint,
+                    "indexed_at": time.time(),
+                },
+            )
+            self.connection.execute(
+                "delete from generated_files where repo = ?", [str(repo)]
+            )
+            for target in targets:
+                path = repo / target
+                if path.exists():
+                    self.connection.execute(
+                        "insert into generated_files values (?, ?, ?)",
+                        [str(repo), target, git_index.blob_hash(path.read_bytes())],
+                    )
+        logger.info(f"Indexed {repo}")
+        return True
+
+    def update_many(
+        self,
+        repos: list[Path],
+        targets: list[str],
+        defaults: nens_toml.Defaults = nens_toml.NO_DEFAULTS,
+    ) -> tuple[int, dict[Path, str]]:
+        """Index the repos, return the number re-indexed and the errors per repo
+
+        A repo with a broken .nens.toml is logged and skipped, it doesn't stop the
+        others.
+        """
+        changed = 0
+        errors = {}
+        for repo in repos:
+            try:
+                changed += self.update(repo, targets, defaults)
+            except (ValueError, OSError) as e:
+                logger.error(f"{repo}: {e}")
+                errors[repo] = str(e)
+        return changed, errors
+
+    def record_run(self, repo: Path, seconds: float):
+        """Store how long the last nens-meta run on the repo took"""
+        with self.connection:
+            self.connection.execute(
+                "update repos set last_run_seconds = ? where path = ?",
+                [seconds, str(repo.absolute())],
+            )
+
+    def repos(self, **conditions) -> list[sqlite3.Row]:
+        """Return the indexed repos, the oldest meta_version first
+
+        Pass column=value keyword arguments to filter, like `python_version="3.11"`.
+        """
+        query = "select * from repos"
+        for column in conditions:
+            if column not in INDEXED_OPTIONS["meta"] + INDEXED_OPTIONS["meta_workflow"]:
+                raise ValueError(f"Unknown column {column}")
+        if conditions:
+            query += " where " + " and ".join(f"{column} = ?" for column in conditions)
+        rows = self.connection.execute(query, list(conditions.values())).fetchall()
+        return sorted(
+            rows, key=lambda row: utils.version_tuple(row["meta_version"] or "")
+        )
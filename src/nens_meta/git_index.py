@@ -0,0 +1,189 @@
+"""Purpose: use git's index to see whether a file is unchanged without reading it
+
+Git's index stores, per file, the hash of the staged content and the stat data
+(mtime, size, inode) of the worktree file at the time it was staged. If the stat
+data still matches, the worktree file is the staged content. If the staged content
+is what we want to write, we don't even have to read the file.
+
+See https://git-scm.com/docs/index-format
+"""
+
+import hashlib
+import logging
+import os
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+REGULAR_FILE = 0o100000
+FILE_TYPE_MASK = 0o170000
+ENTRY_STAT = struct.Struct(">10I20sH")
+EXTENDED_FLAG = 0x4000
+
+_cache: dict[Path, "GitIndex"] = {}
+
+
+@dataclass
+class IndexEntry:
+    mtime_ns: int
+    size: int
+    inode: int
+    mode: int
+    sha: str
+
+
+def blob_hash(content: bytes) -> str:
+    """Return the hash git uses for a file with this content"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def _read_varint(data: bytes, position: int) -> tuple[int, int]:
+    """Return git's "offset" varint at position, plus the position after it"""
+    byte = data[position]
+    position += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        value += 1
+        byte = data[position]
+        position += 1
+        value = (value << 7) + (byte & 0x7F)
+    return value, position
+
+
+def parse_index(data: bytes) -> dict[str, IndexEntry]:
+    """Return the entries of a git index file (versions 2, 3 and 4)"""
+    signature, version, count = struct.unpack_from(">4sII", data)
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise ValueError(f"Unsupported git index (version {version})")
+    entries = {}
+    position = 12
+    previous_path = b""
+    for _ in range(count):
+        entry_start = position
+        (
+            _ctime_s,
+            _ctime_ns,
+            mtime_s,
+            mtime_ns,
+            _dev,
+            inode,
+            mode,
+            _uid,
+            _gid,
+            size,
+            sha,
+            flags,
+        ) = ENTRY_STAT.unpack_from(data, position)
+        position += ENTRY_STAT.size
+        if flags & EXTENDED_FLAG:
+            position += 2
+        if version == 4:
+            strip, position = _read_varint(data, position)
+            end = data.index(b"\0", position)
+            path = previous_path[: len(previous_path) - strip] + data[position:end]
+            position = end + 1
+        else:
+            end = data.index(b"\0", position)
+            path = data[position:end]
+            # Entries are padded with 1-8 NUL bytes to a multiple of 8.
+            position = entry_start + ((end - entry_start) // 8 + 1) * 8
+        previous_path = path
+        entries[path.decode()] = IndexEntry(
+            mtime_ns=mtime_s * 1_000_000_000 + mtime_ns,
+            size=size,
+            inode=inode,
+            mode=mode,
+            sha=sha.hex(),
+        )
+    return entries
+
+
+class GitIndex:
+    """The (parsed) index of one git worktree"""
+
+    worktree: Path
+    index_file: Path
+    index_mtime_ns: int
+    entries: dict[str, IndexEntry]
+
+    def __init__(self, worktree: Path, index_file: Path):
+        self.worktree = worktree
+        self.index_file = index_file
+        self.index_mtime_ns = index_file.stat().st_mtime_ns
+        self.entries = parse_index(index_file.read_bytes())
+
+    def is_unchanged(self, path: Path, content: str) -> bool:
+        """Return True if the worktree file is known to have exactly this content
+
+        False means "not known", the file might still have the same content.
+        """
+        relative = path.absolute().relative_to(self.worktree).as_posix()
+        entry = self.entries.get(relative)
+        if entry is None or entry.mode & FILE_TYPE_MASK != REGULAR_FILE:
+            return False
+        if entry.mtime_ns >= self.index_mtime_ns:
+            # "Racily clean": changed in the same instant the index was written.
+            return False
+        try:
+            stat = os.lstat(path)
+        except OSError:
+            return False
+        if (
+            stat.st_mtime_ns != entry.mtime_ns
+            or stat.st_size & 0xFFFFFFFF != entry.size
+            or stat.st_ino & 0xFFFFFFFF != entry.inode
+        ):
+            return False
+        return blob_hash(content.encode()) == entry.sha
+
+
+def _git_dir(worktree: Path) -> Path | None:
+    dot_git = worktree / ".git"
+    if dot_git.is_dir():
+        return dot_git
+    if dot_git.is_file():
+        # Worktrees and submodules have a "gitdir: ..." file.
+        first_line = dot_git.read_text().strip()
+        if first_line.startswith("gitdir:"):
+            return (worktree / first_line.removeprefix("gitdir:").strip()).resolve()
+    return None
+
+
+def index_for(path: Path) -> GitIndex | None:
+    """Return the git index for the worktree the path is in, if any"""
+    for directory in path.absolute().parents:
+        if directory in _cache:
+            index = _cache[directory]
+            if (
+                index.index_file.exists()
+                and index.index_file.stat().st_mtime_ns == index.index_mtime_ns
+            ):
+                return index
+        git_dir = _git_dir(directory)
+        if git_dir is None:
+            continue
+        index_file = git_dir / "index"
+        config = git_dir / "config"
+        sha256 = (
+            config.exists()
+            and "objectformat=sha256" in config.read_text().lower().replace(" ", "")
+        )
+        if not index_file.exists() or sha256:
+            return None
+        try:
+            _cache[directory] = GitIndex(directory, index_file)
+        except (ValueError, struct.error) as e:
+            logger.debug(f"Not using git index {index_file}: {e}")
+            return None
+        return _cache[directory]
+    return None
+
+
+def is_unchanged(path: Path, content: str) -> bool:
+    """Return True if git's index tells us the file has exactly this content"""
+    index = index_for(path)
+    if index is None:
+        return False
+    return index.is_unchanged(path, content)
@@ -0,0 +1,109 @@
+"""Purpose: make long runs over lots of repos resumable and splittable
+
+The journal is an append-only file with one JSON line per handled repo: its
+status, a fingerprint of its inputs and the outcome. With `--resume`, repos that
+were completed with the same inputs are skipped. A half-written last line (from an
+interrupted run) is ignored.
+
+`--shard i/n` picks the i-th of n deterministic parts of the repos (based on the
+repo's directory name, so it's the same on every machine).
+"""
+
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any
+
+DONE = "done"
+ERROR = "error"
+
+logger = logging.getLogger(__name__)
+
+
+def input_fingerprint(*inputs) -> str:
+    """Return a hash of the (json-serializable) inputs"""
+    as_json = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha1(as_json.encode()).hexdigest()
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+    """Return index and count from "i/n" (i counts from 1)"""
+    index, separator, count = shard.partition("/")
+    try:
+        result = int(index), int(count)
+    except ValueError:
+        result = 0, 0
+    if not separator or not 1 <= result[0] <= result[1]:
+        raise ValueError(f"Shard {shard} should look like 2/5")
+    return result
+
+
+def in_shard(repos: list[Path], shard: str | None) -> list[Path]:
+    """Return the repos belonging to the shard (all of them if no shard given)"""
+    if not shard:
+        return repos
+    index, count = parse_shard(shard)
+    return [
+        repo
+        for repo in repos
+        if int(hashlib.sha1(repo.absolute().name.encode()).hexdigest(), 16) % count
+        == index - 1
+    ]
+
+
+class Journal:
+    """Append-only record of the repos handled in a (multi-repo) run"""
+
+    journal_file: Path
+    completed: dict[str, dict]
+    needs_newline: bool
+
+    def __init__(self, journal_file: Path):
+        self.journal_file = journal_file
+        self.completed = {}
+        self.needs_newline = False
+        if journal_file.exists():
+            content = journal_file.read_text()
+            # An interrupted write can leave an incomplete line without newline.
+            self.needs_newline = bool(content) and not content.endswith("\n")
+            for line in content.splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.debug(f"Ignoring incomplete journal line {line}")
+                    continue
+                if entry["status"] == DONE:
+                    self.completed[entry["repo"]] = entry
+                else:
+                    self.completed.pop(entry["repo"], None)
+
+    def is_done(self, repo: Path, fingerprint: str) -> bool:
+        """Return whether the repo was completed earlier with the same inputs"""
+        entry = self.completed.get(str(repo.absolute()))
+        return entry is not None and entry["fingerprint"] == fingerprint
+
+    def outcome(self, repo: Path) -> Any:
+        """Return the recorded outcome of the completed repo"""
+        return self.completed[str(repo.absolute())]["outcome"]
+
+    def record(self, repo: Path, fingerprint: str, status: str, outcome):
+        """Append the result for the repo to the journal"""
+        entry = {
+            "repo": str(repo.absolute()),
+            "fingerprint": fingerprint,
+            "status": status,
+            "outcome": outcome,
+            "time": time.time(),
+        }
+        self.journal_file.parent.mkdir(parents=True, exist_ok=True)
+        with self.journal_file.open("a") as f:
+            if self.needs_newline:
+                f.write("\n")
+                self.needs_newline = False
+            f.write(json.dumps(entry) + "\n")
+        if status == DONE:
+            self.completed[entry["repo"]] = entry
+        else:
+            self.completed.pop(entry["repo"], None)
@@ -0,0 +1,267 @@
+"""Purpose: audit bare mirrors of repos without checking them out
+
+One `git cat-file --batch` process per mirror reads the tree at a ref and the files
+we need (`.nens.toml`, `pyproject.toml`, the generated files). Requests are
+pipelined: all of them are written at once, the answers are read back in order.
+
+The normal `.nens.toml` validation and rendering then run on a read-only
+filesystem backed by those objects, reporting which files differ from what we'd
+generate ("drift").
+"""
+
+import fnmatch
+import io
+import logging
+import subprocess
+import threading
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+
+from nens_meta import (
+    __version__,
+    filesystem,
+    git_index,
+    journal,
+    nens_toml,
+    pyproject_toml,
+    update_project,
+)
+
+TREE_MODE = b"40000"
+SUBMODULE_MODE = b"160000"
+SHA_LENGTH = 20
+
+logger = logging.getLogger(__name__)
+
+
+def tree_entries(data: bytes) -> Iterator[tuple[bytes, str, str]]:
+    """Return mode, name and hash of the entries of a (binary) tree object"""
+    position = 0
+    while position < len(data):
+        space = data.index(b" ", position)
+        nul = data.index(b"\0", space)
+        sha = data[nul + 1 : nul + 1 + SHA_LENGTH]
+        yield data[position:space], data[space + 1 : nul].decode(), sha.hex()
+        position = nul + 1 + SHA_LENGTH
+
+
+class CatFile:
+    """Long-running `git cat-file --batch` process for one (bare) repo"""
+
+    def __init__(self, git_dir: Path):
+        self.git_dir = git_dir
+        self.process = subprocess.Popen(
+            ["git", "--git-dir", str(git_dir), "cat-file", "--batch"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def __enter__(self) -> "CatFile":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        assert self.process.stdin is not None
+        self.process.stdin.close()
+        self.process.wait()
+
+    def batch(self, specs: list[str]) -> list[tuple[str, bytes] | None]:
+        """Return object name and content per spec ("HEAD:README.md")
+
+        None means the object is missing.
+        """
+        stdin, stdout = self.process.stdin, self.process.stdout
+        assert stdin is not None and stdout is not None
+
+        def send():
+            # In a thread: git blocks when we don't read its output in time.
+            try:
+                stdin.write(b"".join(spec.encode() + b"\n" for spec in specs))
+                stdin.flush()
+            except BrokenPipeError:  # pragma: no cover
+                pass  # Git stopped, we'll notice the missing output.
+
+        writer = threading.Thread(target=send)
+        writer.start()
+        results: list[tuple[str, bytes] | None] = []
+        for _ in specs:
+            header = stdout.readline().split()
+            if len(header) != 3:
+                # "<spec> missing" or "<spec> ambiguous".
+                results.append(None)
+                continue
+            size = int(header[2])
+            content = stdout.read(size + 1)[:size]  # Plus newline.
+            results.append((header[0].decode(), content))
+        writer.join()
+        return results
+
+    def get(self, specs: list[str]) -> list[bytes | None]:
+        """Return the contents of the objects, None if missing"""
+        return [result[1] if result else None for result in self.batch(specs)]
+
+    def resolve(self, spec: str) -> str | None:
+        """Return the object name (hash) of the spec, like `main^{commit}`"""
+        [result] = self.batch([spec])
+        return result[0] if result else None
+
+    def list_tree(self, ref: str) -> dict[str, str]:
+        """Return path and blob hash of all files at the ref, level by level"""
+        files = {}
+        level = [("", f"{ref}^{{tree}}")]
+        while level:
+            trees = self.get([spec for _prefix, spec in level])
+            next_level = []
+            for (prefix, spec), tree in zip(level, trees):
+                if tree is None:
+                    raise ValueError(f"{spec} not found in {self.git_dir}")
+                for mode, name, sha in tree_entries(tree):
+                    if mode == TREE_MODE:
+                        next_level.append((f"{prefix}{name}/", sha))
+                    elif mode != SUBMODULE_MODE:
+                        files[prefix + name] = sha
+            level = next_level
+        return files
+
+
+class MirrorFilesystem(filesystem.Filesystem):
+    """Read-only filesystem with the files of a ref in a mirror
+
+    `project` is the (fictional) directory the files appear in. `prefetch` files
+    are read in one batch up front, others on demand.
+    """
+
+    project: Path
+    files: dict[str, str]
+    dirs: set[str]
+    contents: dict[str, str]
+
+    def __init__(self, cat_file: CatFile, ref: str, project: Path, prefetch: list[str]):
+        self.cat_file = cat_file
+        self.project = project
+        self.files = cat_file.list_tree(ref)
+        self.dirs = {
+            str(parent)
+            for name in self.files
+            for parent in PurePosixPath(name).parents
+            if str(parent) != "."
+        }
+        wanted = [name for name in prefetch if name in self.files]
+        blobs = cat_file.get([self.files[name] for name in wanted])
+        self.contents = {
+            name: blob.decode() for name, blob in zip(wanted, blobs) if blob is not None
+        }
+
+    def _relative(self, path: Path) -> str:
+        return path.relative_to(self.project).as_posix()
+
+    def exists(self, path: Path) -> bool:
+        return self._relative(path) in self.files or self.is_dir(path)
+
+    def is_dir(self, path: Path) -> bool:
+        relative = self._relative(path)
+        return relative == "." or relative in self.dirs
+
+    def read_text(self, path: Path) -> str:
+        relative = self._relative(path)
+        if relative not in self.contents:
+            if relative not in self.files:
+                raise FileNotFoundError(path)
+            [blob] = self.cat_file.get([self.files[relative]])
+            assert blob is not None
+            self.contents[relative] = blob.decode()
+        return self.contents[relative]
+
+    def iter_lines(self, path: Path) -> Iterator[str]:
+        return iter(io.StringIO(self.read_text(path)))
+
+    def write_text(self, path: Path, content: str):
+        raise PermissionError(f"{path}: mirrors are read-only")
+
+    def unlink(self, path: Path):
+        raise PermissionError(f"{path}: mirrors are read-only")
+
+    def mkdir(self, path: Path):
+        raise PermissionError(f"{path}: mirrors are read-only")
+
+    def rmdir(self, path: Path):
+        raise PermissionError(f"{path}: mirrors are read-only")
+
+    def glob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        for name in sorted(self.files):
+            path = self.project / name
+            if path.parent == directory and fnmatch.fnmatch(path.name, pattern):
+                yield path
+
+    def rglob(self, directory: Path, pattern: str) -> Iterator[Path]:
+        for name in sorted(self.files):
+            path = self.project / name
+            if directory in path.parents and fnmatch.fnmatch(path.name, pattern):
+                yield path
+
+    def known_to_contain(self, path: Path, content: str) -> bool:
+        sha = self.files.get(self._relative(path))
+        return sha == git_index.blob_hash(content.encode())
+
+
+@dataclass
+class Audit:
+    """Outcome of auditing one mirror"""
+
+    mirror: Path
+    drifted: list[str] = field(default_factory=list)
+    error: str | None = None
+    skipped: bool = False
+
+
+def audit_mirror(
+    mirror: Path,
+    ref: str = "HEAD",
+    defaults: nens_toml.Defaults = nens_toml.NO_DEFAULTS,
+    run_journal: journal.Journal | None = None,
+    resume: bool = False,
+) -> Audit:
+    """Return the files in the mirror that differ from what we would generate
+
+    The outcome is recorded in the journal, if given. With `resume`, a mirror the
+    journal lists as done for the same commit is skipped: its recorded drift is
+    returned.
+    """
+    with CatFile(mirror) as cat_file:
+        commit = cat_file.resolve(f"{ref}^{{commit}}")
+        fingerprint = journal.input_fingerprint(__version__, defaults.sections, commit)
+        if resume and run_journal and run_journal.is_done(mirror, fingerprint):
+            logger.debug(f"{mirror} already audited at {commit}")
+            return Audit(mirror, drifted=run_journal.outcome(mirror), skipped=True)
+        result = _audit(cat_file, mirror, ref, defaults)
+    if run_journal:
+        if result.error:
+            run_journal.record(mirror, fingerprint, journal.ERROR, result.error)
+        else:
+            run_journal.record(mirror, fingerprint, journal.DONE, result.drifted)
+    return result
+
+
+def _audit(
+    cat_file: CatFile, mirror: Path, ref: str, defaults: nens_toml.Defaults
+) -> Audit:
+    project = Path("/") / mirror.absolute().name.removesuffix(".git")
+    prefetch = [
+        nens_toml.META_FILENAME,
+        pyproject_toml.UV_LOCK_FILENAME,
+    ] + update_project.generated_targets()
+    try:
+        fs = MirrorFilesystem(cat_file, ref, project, prefetch)
+        overlay = filesystem.OverlayFilesystem(fs)
+        nens_toml.create_if_missing(project, overlay)
+        our_config = nens_toml.OurConfig(project, fs=overlay, defaults=defaults)
+        update_project.plan_changes(project, our_config).apply()
+    except (ValueError, nens_toml.MissingDocumentationError) as e:
+        return Audit(mirror, error=str(e))
+    drifted = [
+        path.relative_to(project).as_posix() for path in sorted(overlay.changed_files())
+    ]
+    return Audit(mirror, drifted=drifted)
@@ -1,7 +1,13 @@
 """Purpose: read and manage the .nens.toml config file"""
 
 import copy
+import functools
+import hashlib
+import json
 import logging
+import tomllib
+import typing
+from collections.abc import Callable
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any
@@ -9,18 +15,20 @@ from typing import Any
 import tomlkit
 from tomlkit.items import Table
 
-from nens_meta import __version__, utils
+from nens_meta import __version__, changeset, filesystem, utils
 
 
 @dataclass
 class Option:
     key: str
     description: str
-    value_type: type = str
+    value_type: Any = str  # A type or a list of a type, like list[str]
     default: Any = ""
 
 
 META_FILENAME = ".nens.toml"
+DEFAULTS_ENVVAR = "NENS_META_DEFAULTS"
+MERGED_CACHE_SIZE = 1000
 KNOWN_SECTIONS: dict[str, list[Option]] = {}
 # First key is the section name, the second key/value pair is the variable name and the
 # explanation. If the second key ends with "_TRUE"/"_FALSE", this is stripped and will
@@ -45,6 +53,14 @@ KNOWN_SECTIONS["meta"] = [
     ),
 ]
 KNOWN_SECTIONS["pyprojecttoml"] = []
+KNOWN_SECTIONS["gitignore"] = [
+    Option(
+        key="drop_duplicate_extra_lines",
+        description="Remove extra lines that are already in the generated part",
+        default=False,
+        value_type=bool,
+    ),
+]
 KNOWN_SECTIONS["meta_workflow"] = [
     Option(
         key="python_version",
@@ -61,9 +77,154 @@ KNOWN_SECTIONS["meta_workflow"] = [
 
 logger = logging.getLogger(__name__)
 
+JSON_SCHEMA_TYPES = {str: "string", bool: "boolean", int: "integer", float: "number"}
+
+
+def _type_name(value_type: Any) -> str:
+    return getattr(value_type, "__name__", str(value_type))
+
+
+def _compile_check(value_type: Any) -> Callable[[Any], bool]:
+    """Return a function that checks whether a value has the type"""
+    if typing.get_origin(value_type) is list:
+        [item_type] = typing.get_args(value_type)
+        item_check = _compile_check(item_type)
+        return lambda value: isinstance(value, list) and all(map(item_check, value))
+    if value_type in (int, float):
+        # In python, a bool is an int, in toml it isn't.
+        return lambda value: (
+            isinstance(value, value_type) and not isinstance(value, bool)
+        )
+    return lambda value: isinstance(value, value_type)
+
+
+@dataclass
+class CompiledSection:
+    """The options of a section, indexed by key, with their type checks"""
+
+    options: dict[str, Option]
+    checks: dict[str, Callable[[Any], bool]]
+
+
+def compile_schema(sections: dict[str, list[Option]]) -> dict[str, CompiledSection]:
+    return {
+        section_name: CompiledSection(
+            options={option.key: option for option in options},
+            checks={
+                option.key: _compile_check(option.value_type) for option in options
+            },
+        )
+        for section_name, options in sections.items()
+    }
+
+
+SCHEMA = compile_schema(KNOWN_SECTIONS)
+
+
+class ValidationError(ValueError):
+    """One or more wrongly-typed values"""
+
+    def __init__(self, errors: list[str]):
+        self.errors = errors
+        super().__init__("\n".join(errors))
+
+
+def validate_section(section_name: str, section: dict) -> list[str]:
+    """Return the errors in the (known) section's values"""
+    checks = SCHEMA[section_name].checks
+    errors = []
+    for key, value in section.items():
+        if key in checks and not checks[key](value):
+            option = SCHEMA[section_name].options[key]
+            errors.append(
+                f"[{section_name}] {key} should be of type "
+                f"{_type_name(option.value_type)}, not {type(value).__name__}"
+            )
+    return errors
+
+
+def validate(contents: dict) -> list[str]:
+    """Return all errors in the contents of a .nens.toml (or defaults) file
+
+    Unknown sections and options are no errors, see `unknown_options()`.
+    """
+    errors = []
+    for section_name, section in contents.items():
+        if section_name not in SCHEMA:
+            continue
+        if not isinstance(section, dict):
+            errors.append(f"[{section_name}] should be a table")
+            continue
+        errors += validate_section(section_name, section)
+    return errors
+
+
+def unknown_options(contents: dict) -> list[str]:
+    """Return the unknown (misspelled or old) sections and options"""
+    unknown = []
+    for section_name, section in contents.items():
+        if section_name not in SCHEMA:
+            unknown.append(f"[{section_name}] is not known")
+        elif isinstance(section, dict):
+            unknown += [
+                f"[{section_name}] {key} is not known"
+                for key in section
+                if key not in SCHEMA[section_name].options
+            ]
+    return unknown
+
+
+def validate_file(
+    config_file: Path, fs: filesystem.Filesystem = filesystem.DISK
+) -> tuple[list[str], list[str]]:
+    """Return errors and warnings for the file, without looking at the project"""
+    try:
+        contents = tomllib.loads(fs.read_text(config_file))
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        return [f"Cannot read: {e}"], []
+    return validate(contents), unknown_options(contents)
+
+
+def _json_schema_type(value_type: Any) -> dict:
+    if typing.get_origin(value_type) is list:
+        [item_type] = typing.get_args(value_type)
+        return {"type": "array", "items": _json_schema_type(item_type)}
+    return {"type": JSON_SCHEMA_TYPES[value_type]}
+
+
+def json_schema() -> dict:
+    """Return a JSON Schema for .nens.toml, for editors
+
+    Unknown sections and options are allowed, like in `validate()`: they are only
+    warned about.
+    """
+    return {
+        "$schema": "https://json-schema.org/draft/2020-12/schema",
+        "title": "nens-meta configuration (.nens.toml)",
+        "type": "object",
+        "properties": {
+            section_name: {
+                "type": "object",
+                "properties": {
+                    option.key: {
+                        "description": option.description,
+                        "default": option.default,
+                        **_json_schema_type(option.value_type),
+                    }
+                    for option in options
+                },
+            }
+            for section_name, options in KNOWN_SECTIONS.items()
+        },
+    }
+
 
 def write_documentation():
-    target = Path(__file__).parent.parent.parent / "doc" / "nens_toml_example.toml"
+    doc_dir = Path(__file__).parent.parent.parent / "doc"
+    (doc_dir / "_static" / "nens_toml_schema.json").write_text(
+        json.dumps(json_schema(), indent=2) + "\n"
+    )
+    target = doc_dir / "nens_toml_example.toml"
     lines = []
     for section in KNOWN_SECTIONS:
         lines.append(f"[{section}]")
@@ -81,20 +242,22 @@ def nens_toml_file(project: Path) -> Path:
     return project / META_FILENAME
 
 
-def create_if_missing(project: Path):
-    if not nens_toml_file(project).exists():
-        nens_toml_file(project).write_text("")
-    our_config = OurConfig(project)
+def create_if_missing(project: Path, fs: filesystem.Filesystem = filesystem.DISK):
+    if not fs.exists(nens_toml_file(project)):
+        fs.write_text(nens_toml_file(project), "")
+    our_config = OurConfig(project, fs)
     our_config.read()
     our_config.update_meta_options()
     our_config.write()
 
 
-def detected_meta_values(project: Path) -> dict[str, str | bool | list]:
+def detected_meta_values(
+    project: Path, fs: filesystem.Filesystem = filesystem.DISK
+) -> dict[str, str | bool | list]:
     """Return values we can detect about the project, normally set in [meta]"""
     detected: dict[str, str | bool | list] = {}
-    detected["uses_python"] = utils.uses_python(project)
-    detected["uses_ansible"] = utils.uses_ansible(project)
+    detected["uses_python"] = utils.uses_python(project, fs)
+    detected["uses_ansible"] = utils.uses_ansible(project, fs)
     detected["meta_version"] = __version__
     name = project.resolve().name
     detected["project_name"] = name
@@ -105,6 +268,68 @@ class MissingDocumentationError(Exception):
     pass
 
 
+class Defaults:
+    """Shared (organisation-wide) defaults, layered beneath each .nens.toml
+
+    The defaults file has the same layout as .nens.toml. It is validated once when
+    loading. The merged options are cached per distinct section content, so
+    running over lots of projects (that mostly share their [meta_workflow], for
+    instance) doesn't redo the same work over and over. The
+    cache holds at most `MERGED_CACHE_SIZE` entries, `cache_merged=False` disables
+    it (as for the shared `NO_DEFAULTS`).
+    """
+
+    sections: dict[str, dict]
+    merged_cache: dict[tuple[str, str], dict] | None
+
+    def __init__(self, contents: dict, cache_merged: bool = True):
+        self.sections = {}
+        self.merged_cache = {} if cache_merged else None
+        # Same rules as for .nens.toml: wrong types are errors, unknown sections
+        # and options only warnings.
+        errors = validate(contents)
+        if errors:
+            raise ValidationError(errors)
+        for unknown in unknown_options(contents):
+            logger.warning(f"Defaults: {unknown}")
+        self.sections = {
+            name: dict(section) for name, section in contents.items() if name in SCHEMA
+        }
+
+    def get(self, section_name: str, option: Option) -> Any:
+        """Return the shared default, falling back to the documented default"""
+        section = self.sections.get(section_name, {})
+        if option.key in section:
+            return copy.deepcopy(section[option.key])
+        return copy.deepcopy(option.default)
+
+    def cached(self, key: tuple[str, str]) -> dict | None:
+        """Return a copy of the merged options, if cached"""
+        if self.merged_cache is None or key not in self.merged_cache:
+            return None
+        return copy.deepcopy(self.merged_cache[key])
+
+    def cache(self, key: tuple[str, str], options: dict):
+        if self.merged_cache is None:
+            return
+        if len(self.merged_cache) >= MERGED_CACHE_SIZE:
+            # Drop the oldest entry.
+            del self.merged_cache[next(iter(self.merged_cache))]
+        self.merged_cache[key] = copy.deepcopy(options)
+
+
+NO_DEFAULTS = Defaults({}, cache_merged=False)
+
+
+@functools.cache
+def load_defaults(
+    defaults_file: Path, fs: filesystem.Filesystem = filesystem.DISK
+) -> Defaults:
+    """Return the parsed and validated defaults file (parsed only once)"""
+    logger.debug(f"Reading shared defaults from {defaults_file}")
+    return Defaults(tomlkit.parse(fs.read_text(defaults_file)).unwrap())
+
+
 class OurConfig:
     """Wrapper around a project's .nens.toml
 
@@ -114,27 +339,45 @@ class OurConfig:
     _config_file: Path
     _contents: tomlkit.TOMLDocument
     _project: Path
-
-    def __init__(self, project: Path):
+    fs: filesystem.Filesystem
+    defaults: Defaults
+    _content_hash: str
+    _section_hashes: dict[str, str]
+    _validated_hash: str | None
+
+    def __init__(
+        self,
+        project: Path,
+        fs: filesystem.Filesystem = filesystem.DISK,
+        defaults: Defaults = NO_DEFAULTS,
+    ):
         self._project = project
+        self.fs = fs
+        self.defaults = defaults
         self._config_file = nens_toml_file(project)
+        self._validated_hash = None
         self._contents = self.read()
         self.update_meta_options()
 
     def read(self) -> tomlkit.TOMLDocument:
-        return tomlkit.parse(self._config_file.read_text())
+        return tomlkit.parse(self.fs.read_text(self._config_file))
 
-    def write(self):
-        utils.write_if_changed(
+    def stage(self, changes: changeset.ChangeSet):
+        changes.add(
             self._config_file, tomlkit.dumps(self._contents), handle_extra_lines=False
         )
 
+    def write(self):
+        changes = changeset.ChangeSet(self.fs)
+        self.stage(changes)
+        changes.apply()
+
     def update_meta_options(self):
         """Detect meta options"""
         if "meta" not in self._contents:
             self._contents.append("meta", tomlkit.table())
         current: Table = self._contents["meta"]  # type: ignore
-        detected = detected_meta_values(self._project)
+        detected = detected_meta_values(self._project, self.fs)
         must_be_set = ["meta_version"]
         for key, value in detected.items():
             if key not in current:
@@ -144,37 +387,60 @@ class OurConfig:
                 if current["meta_version"] != detected["meta_version"]:
                     current["meta_version"] = detected["meta_version"]
                     logger.info(".nens.toml: changing [meta]->meta_version")
+        # The only place where we change the contents, so hash them once here.
+        self._content_hash = hashlib.sha1(
+            self._contents.as_string().encode()
+        ).hexdigest()
+        contents = self._contents.unwrap()
+        self._section_hashes = {
+            section_name: hashlib.sha1(
+                json.dumps(
+                    contents.get(section_name), sort_keys=True, default=str
+                ).encode()
+            ).hexdigest()
+            for section_name in SCHEMA
+        }
 
     def has_section_for(self, section_name: str) -> bool:
         return section_name in KNOWN_SECTIONS
 
     def section_options(self, section_name: str) -> dict:
-        """Return all options configured in a given section, if available."""
-        if section_name not in KNOWN_SECTIONS:
+        """Return all options configured in a given section, if available.
+
+        Options missing from .nens.toml get their value from the shared defaults,
+        if available, and otherwise from the documented default.
+        """
+        if section_name not in SCHEMA:
             # Force ourselves to document our stuff!
             raise MissingDocumentationError(
                 f"Section {section_name} not documented in nens-meta"
             )
+        if self._content_hash != self._validated_hash:
+            # Check the whole file at once to report all errors in one go.
+            contents = self._contents.unwrap()
+            errors = validate(contents)
+            if errors:
+                raise ValidationError(errors)
+            for unknown in unknown_options(contents):
+                logger.warning(f"{self._config_file}: {unknown}")
+            self._validated_hash = self._content_hash
+
+        # Keyed on the section only, so other projects can share the entry.
+        cache_key = (section_name, self._section_hashes[section_name])
+        cached = self.defaults.cached(cache_key)
+        if cached is not None:
+            return cached
         section = self._contents.get(section_name)
         if section is None:
             section = {}
         options: dict[str, str | bool | list] = {}
-        for option in KNOWN_SECTIONS[section_name]:
-            value = section.get(option.key, copy.deepcopy(option.default))
-            if not isinstance(value, option.value_type):
-                raise ValueError(
-                    f"{option.key} should be of type {option.value_type}, not {type(value)}"
-                )
-            options[option.key] = value
-
-        # Warn for old/misspelled options.
-        known_keys = [option.key for option in KNOWN_SECTIONS[section_name]]
-        for key in section:
-            if key not in known_keys:
-                logger.warning(
-                    f"Parameter {key} in section [{section_name}] is not known"
-                )
+        for key, option in SCHEMA[section_name].options.items():
+            if key in section:
+                options[key] = section[key]
+            else:
+                options[key] = self.defaults.get(section_name, option)
         logger.debug(f"Contents of section {section_name}: {options}")
+        self.defaults.cache(cache_key, options)
         return options
 
 
@@ -0,0 +1,168 @@
+"""Purpose: write the changes nens-meta would make as patches, one per repo
+
+The whole update runs on top of an `OverlayFilesystem`, so the checkouts are only
+read. The result is a `git apply`-compatible patch per repo, handy for rolling out
+a new nens-meta version over lots of repos in batches. Repos are handled in
+parallel.
+"""
+
+import contextlib
+import difflib
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from nens_meta import (
+    __version__,
+    filesystem,
+    fleet_index,
+    journal,
+    nens_toml,
+    pyproject_toml,
+    update_project,
+)
+
+NO_NEWLINE = "\\ No newline at end of file\n"
+
+logger = logging.getLogger(__name__)
+# Per worker process, so the merged-options cache is shared by its repos.
+_worker_defaults = nens_toml.NO_DEFAULTS
+
+
+def file_diff(relative: str, old: str | None, new: str) -> str:
+    """Return a git-style diff for one file, `old` is None for a new file"""
+    old_lines = (old or "").splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    header = f"diff --git a/{relative} b/{relative}\n"
+    if old is None:
+        header += "new file mode 100644\n"
+    lines = []
+    for line in difflib.unified_diff(
+        old_lines,
+        new_lines,
+        fromfile="/dev/null" if old is None else f"a/{relative}",
+        tofile=f"b/{relative}",
+    ):
+        lines.append(line)
+        if not line.endswith("\n"):
+            # Last line without newline.
+            lines[-1] += "\n" + NO_NEWLINE
+    return header + "".join(lines)
+
+
+def repo_patch(repo: Path, defaults: nens_toml.Defaults = nens_toml.NO_DEFAULTS) -> str:
+    """Return the patch with all changes nens-meta would make to the repo"""
+    problem = update_project.project_problem(repo)
+    if problem:
+        raise ValueError(problem)
+    overlay = filesystem.OverlayFilesystem(filesystem.DISK)
+    nens_toml.create_if_missing(repo, overlay)
+    our_config = nens_toml.OurConfig(repo, fs=overlay, defaults=defaults)
+    update_project.plan_changes(repo, our_config).apply()
+    diffs = []
+    for path, content in sorted(overlay.changed_files().items()):
+        old = filesystem.DISK.read_text(path) if filesystem.DISK.exists(path) else None
+        if old != content:
+            diffs.append(file_diff(path.relative_to(repo).as_posix(), old, content))
+    return "".join(diffs)
+
+
+def _safe_repo_patch(
+    repo: Path, defaults: nens_toml.Defaults
+) -> tuple[str, str | None]:
+    """Return the patch and the error, if any (a bad repo shouldn't stop the run)"""
+    try:
+        return repo_patch(repo, defaults), None
+    except (ValueError, OSError, nens_toml.MissingDocumentationError) as e:
+        return "", str(e)
+
+
+def _init_worker(defaults: nens_toml.Defaults):
+    global _worker_defaults
+    _worker_defaults = defaults
+
+
+def _worker_repo_patch(repo: Path) -> tuple[str, str | None]:
+    return _safe_repo_patch(repo, _worker_defaults)
+
+
+def repo_fingerprint(repo: Path, defaults: nens_toml.Defaults) -> str:
+    """Return a fingerprint of the inputs of the repo's patch"""
+    targets = [pyproject_toml.UV_LOCK_FILENAME] + update_project.generated_targets()
+    return journal.input_fingerprint(
+        __version__, defaults.sections, fleet_index.fingerprint(repo, targets)
+    )
+
+
+def patch_files(repos: list[Path], output_dir: Path) -> dict[Path, Path]:
+    """Return a unique patch filename per repo, based on the directory name"""
+    result = {}
+    used_names = set()
+    for repo in repos:
+        name = repo.absolute().name
+        candidate = name
+        for number in itertools.count(2):
+            if candidate not in used_names:
+                break
+            candidate = f"{name}-{number}"
+        used_names.add(candidate)
+        result[repo] = output_dir / f"{candidate}.patch"
+    return result
+
+
+def write_patches(
+    repos: list[Path],
+    output_dir: Path,
+    defaults: nens_toml.Defaults = nens_toml.NO_DEFAULTS,
+    workers: int | None = None,
+    run_journal: journal.Journal | None = None,
+    resume: bool = False,
+) -> dict[Path, Path]:
+    """Write a patch per repo that needs changes, return the patch files
+
+    `workers=1` handles the repos one by one in this process, otherwise a pool of
+    processes is used (by default one per CPU). Every handled repo is recorded in
+    the journal, if given. With `resume`, repos the journal lists as done (with
+    the same inputs) are skipped.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    filenames = patch_files(repos, output_dir)
+    fingerprints = {repo: repo_fingerprint(repo, defaults) for repo in repos}
+    todo = repos
+    if resume and run_journal:
+        todo = [
+            repo for repo in repos if not run_journal.is_done(repo, fingerprints[repo])
+        ]
+        logger.info(f"Skipping {len(repos) - len(todo)} repos that are already done")
+    result = {}
+    with contextlib.ExitStack() as stack:
+        if workers == 1:
+            outcomes = map(_safe_repo_patch, todo, itertools.repeat(defaults))
+        else:
+            # The defaults are passed once per worker instead of once per repo.
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_init_worker,
+                    initargs=(defaults,),
+                )
+            )
+            outcomes = executor.map(_worker_repo_patch, todo)
+        for repo, (patch, error) in zip(todo, outcomes):
+            patch_file = filenames[repo]
+            if error:
+                logger.error(f"{repo}: {error}")
+                status, outcome = journal.ERROR, error
+            elif patch:
+                patch_file.write_text(patch)
+                logger.info(f"Wrote {patch_file}")
+                result[repo] = patch_file
+                status, outcome = journal.DONE, str(patch_file)
+            else:
+                logger.info(f"{repo} is up to date")
+                patch_file.unlink(missing_ok=True)  # From an earlier run.
+                status, outcome = journal.DONE, "up to date"
+            if run_journal:
+                run_journal.record(repo, fingerprints[repo], status, outcome)
+    return result
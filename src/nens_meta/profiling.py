@@ -0,0 +1,140 @@
+"""Purpose: profile the phases of a run to find out why a project is slow
+
+Per phase (reading the config, pyproject.toml, every generated file), a `.pstats`
+file is written. `stacks.collapsed` has all phases in the "collapsed stack" format
+that flamegraph tools (flamegraph.pl, speedscope, inferno) understand.
+`allocations.txt` lists the lines that allocated the most memory.
+"""
+
+import contextlib
+import cProfile
+import logging
+import pstats
+import re
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Generator
+from pathlib import Path
+
+TOP_ALLOCATIONS = 25
+MIN_MICROSECONDS = 1
+MAX_DEPTH = 200
+
+logger = logging.getLogger(__name__)
+
+# pstats' function key: (filename, line number, function name).
+Function = tuple[str, int, str]
+
+
+def _label(function: Function) -> str:
+    filename, lineno, name = function
+    if filename == "~":
+        # Built-in function.
+        label = name
+    else:
+        label = f"{Path(filename).name}:{lineno}({name})"
+    return label.replace(";", ":").replace(" ", "_")
+
+
+def collapsed_stacks(stats: dict, root: str) -> dict[str, int]:
+    """Return "frame;frame;frame" stacks with their (self) time in microseconds
+
+    cProfile only records caller/callee pairs, not complete stacks. The time of a
+    function is divided over its callees in proportion to the time spent in each of
+    them, like other pstats-to-flamegraph converters do.
+    """
+    children: dict[Function, list[tuple[Function, float]]] = defaultdict(list)
+    roots = []
+    for function, (_cc, _nc, _tt, _ct, callers) in stats.items():
+        if not callers:
+            roots.append(function)
+        for caller, caller_stats in callers.items():
+            children[caller].append((function, caller_stats[3]))
+
+    result: dict[str, int] = defaultdict(int)
+
+    def walk(function: Function, stack: list[Function], budget: float):
+        _cc, _nc, own_time, total_time, _callers = stats[function]
+        ratio = budget / total_time if total_time else 0
+        microseconds = round(own_time * ratio * 1_000_000)
+        labels = [root] + [_label(frame) for frame in stack]
+        if microseconds >= MIN_MICROSECONDS:
+            result[";".join(labels)] += microseconds
+        if len(stack) >= MAX_DEPTH:
+            return
+        for child, child_time in children[function]:
+            child_budget = child_time * ratio
+            if child in stack or child_budget * 1_000_000 < MIN_MICROSECONDS:
+                continue  # Recursion or not worth mentioning.
+            walk(child, stack + [child], child_budget)
+
+    for function in roots:
+        walk(function, [function], stats[function][3])
+    return dict(result)
+
+
+def _slug(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_")
+
+
+class Profiler:
+    """Profile named phases, write the results with `finish()`
+
+    Using the same phase name more than once adds up the results.
+    """
+
+    output_dir: Path
+    profiles: dict[str, list[cProfile.Profile]]
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = output_dir
+        self.profiles = {}
+        tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Generator[None, None, None]:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.profiles.setdefault(name, []).append(profile)
+
+    def finish(self):
+        # Before writing the results: that allocates plenty by itself.
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            ]
+        )
+        tracemalloc.stop()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stack_lines = []
+        for number, (name, profiles) in enumerate(self.profiles.items()):
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(self.output_dir / f"{number:02d}-{_slug(name)}.pstats")
+            stacks = collapsed_stacks(stats.stats, name)  # type: ignore
+            stack_lines += [f"{stack} {value}" for stack, value in stacks.items()]
+        (self.output_dir / "stacks.collapsed").write_text(
+            "".join(line + "\n" for line in stack_lines)
+        )
+        top = snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        (self.output_dir / "allocations.txt").write_text(
+            "".join(f"{statistic}\n" for statistic in top)
+        )
+        logger.info(f"Wrote profiling results to {self.output_dir}")
+
+
+class NoProfiler:
+    """Stand-in for `Profiler` when we're not profiling"""
+
+    def phase(self, name: str) -> contextlib.AbstractContextManager:
+        return contextlib.nullcontext()
+
+    def finish(self):
+        pass
+
+
+NO_PROFILER = NoProfiler()
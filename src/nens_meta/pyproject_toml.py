@@ -1,6 +1,8 @@
 """Purpose: read and manage the pyproject.toml config file"""
 
 import logging
+import re
+from collections.abc import Iterable
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import Any
@@ -9,9 +11,23 @@ import tomlkit
 from tomlkit.items import Table
 from tomlkit.toml_document import TOMLDocument
 
-from nens_meta import utils
+from nens_meta import changeset, filesystem, toml_patch, utils
 
 FILENAME = "pyproject.toml"
+UV_LOCK_FILENAME = "uv.lock"
+DEV_PACKAGES = [
+    "pytest>=8.4.2",
+    "pytest-cov>=6.3.0",
+    "pytest-sugar>=1.1.1",
+]
+MINIMUM_REQUIREMENT = re.compile(
+    r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?:>=\s*([^,;\s]+))?"
+)
+LOCK_NAME_OR_VERSION = re.compile(r'^(name|version) = "([^"]*)"')
+INITIAL_CONTENT = (
+    "# Initially generated by nens-meta\n"
+    + "# See https://nens-meta.readthedocs.io/en/latest/config-files.html\n"
+)
 
 logger = logging.getLogger(__name__)
 
@@ -20,15 +36,81 @@ def pyproject_toml_file(project: Path) -> Path:
     return project / FILENAME
 
 
-def create_if_missing(project: Path):
-    if not pyproject_toml_file(project).exists():
-        pyproject_toml_file(project).write_text(
-            "# Initially generated by nens-meta\n"
-            + "# See https://nens-meta.readthedocs.io/en/latest/config-files.html\n"
-        )
+def create_if_missing(project: Path, fs: filesystem.Filesystem = filesystem.DISK):
+    if not fs.exists(pyproject_toml_file(project)):
+        fs.write_text(pyproject_toml_file(project), INITIAL_CONTENT)
         logger.info("Created empty pyproject.toml")
 
 
+def _normalize_name(name: str) -> str:
+    """Return normalized package name, see PEP 503"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def locked_versions(lines: Iterable[str], names: set[str]) -> dict[str, str]:
+    """Return the locked versions of the packages found in uv.lock's lines
+
+    Reading stops as soon as all packages have been found, uv.lock files can be big.
+    """
+    found: dict[str, str] = {}
+    in_package = False
+    current_name = None
+    for line in lines:
+        if line.startswith("["):
+            in_package = line.strip() == "[[package]]"
+            current_name = None
+            continue
+        if not in_package:
+            continue
+        match = LOCK_NAME_OR_VERSION.match(line)
+        if match is None:
+            continue
+        key, value = match.groups()
+        if key == "name":
+            current_name = _normalize_name(value)
+        elif current_name in names and current_name not in found:
+            found[current_name] = value
+            if len(found) == len(names):
+                break
+    return found
+
+
+def check_uv_lock(
+    project: Path,
+    requirements: list[str],
+    fs: filesystem.Filesystem = filesystem.DISK,
+) -> list[str]:
+    """Return (and log) problems with the requirements in the project's uv.lock
+
+    Problems are requirements missing from uv.lock or locked below their minimum.
+    """
+    lock_file = project / UV_LOCK_FILENAME
+    if not fs.exists(lock_file):
+        logger.debug(f"No {UV_LOCK_FILENAME}, not checking locked versions")
+        return []
+    minimums: dict[str, str | None] = {}
+    for requirement in requirements:
+        match = MINIMUM_REQUIREMENT.match(requirement)
+        if match:
+            name, minimum = match.groups()
+            minimums[_normalize_name(name)] = minimum
+    locked = locked_versions(fs.iter_lines(lock_file), set(minimums))
+
+    problems = []
+    for name, minimum in minimums.items():
+        if name not in locked:
+            problems.append(f"{name} is not in {UV_LOCK_FILENAME}")
+        elif minimum and utils.version_tuple(locked[name]) < utils.version_tuple(
+            minimum
+        ):
+            problems.append(
+                f"{name} is locked at {locked[name]}, we suggest at least {minimum}"
+            )
+    for problem in problems:
+        logger.warning(f"{UV_LOCK_FILENAME}: {problem} (run 'uv lock --upgrade')")
+    return problems
+
+
 def write_documentation():
     options = {"project_name": "example-project"}
     target = Path(__file__).parent.parent.parent / "doc" / "pyproject_toml_example.toml"
@@ -44,27 +126,63 @@ def write_documentation():
 
 
 class PyprojectToml:
-    """Wrapper around a project's pyproject.toml"""
+    """Wrapper around a project's pyproject.toml
+
+    Our own adjustments are spliced into the original text (see `toml_patch`), so
+    the rest of the file is left exactly as it was. The tomlkit document in
+    `_contents` is only parsed when it is really needed.
+    """
 
     _project: Path
     _config_file: Path
-    _contents: tomlkit.TOMLDocument
+    _text: str
+    _document: tomlkit.TOMLDocument | None
     _options: dict
+    fs: filesystem.Filesystem
 
-    def __init__(self, project: Path, options: dict):
+    def __init__(
+        self,
+        project: Path,
+        options: dict,
+        fs: filesystem.Filesystem = filesystem.DISK,
+    ):
         self._project = project
+        self.fs = fs
         self._config_file = pyproject_toml_file(project)
         self._options = options
-        self._contents = self.read()
+        self._text = self._read_text()
+        self._document = None
+
+    def _read_text(self) -> str:
+        """Return the file's text, a missing file is treated as a new empty one"""
+        if not self.fs.exists(self._config_file):
+            return INITIAL_CONTENT
+        return self.fs.read_text(self._config_file)
 
     def read(self) -> tomlkit.TOMLDocument:
-        return tomlkit.parse(self._config_file.read_text())
+        return tomlkit.parse(self._read_text())
 
-    def write(self):
+    @property
+    def _contents(self) -> tomlkit.TOMLDocument:
+        if self._document is None:
+            self._document = tomlkit.parse(self._text)
+        return self._document
+
+    def _current_text(self) -> str:
+        """Return the text, including changes made to the parsed document"""
+        if self._document is not None:
+            self._text = tomlkit.dumps(self._document)
+            self._document = None
+        return self._text
+
+    def stage(self, changes: changeset.ChangeSet):
         target = self._project / FILENAME
-        utils.write_if_changed(
-            target, tomlkit.dumps(self._contents), handle_extra_lines=False
-        )
+        changes.add(target, self._current_text(), handle_extra_lines=False)
+
+    def write(self):
+        changes = changeset.ChangeSet(self.fs)
+        self.stage(changes)
+        changes.apply()
 
     def get_or_create_section(self, name: str) -> Table:
         *super_tables, section_name = name.split(".")
@@ -94,14 +212,26 @@ class PyprojectToml:
         self.adjust_zestreleaser()
         self.adjust_dev_packages()
         self.remove_old_sections()
+        self.check_dev_packages_locked()
 
     def _suggest(self, section_name: str, key: str, value: Any, strongly=False):
-        section = self.get_or_create_section(section_name)
-        if key not in section:
-            section[key] = value
+        original_text = self._current_text()
+        try:
+            self._text, current = toml_patch.setdefault(
+                original_text, section_name, key, value
+            )
+            suggested = self._text != original_text
+        except toml_patch.UnsupportedLayoutError as e:
+            logger.debug(f"pyproject.toml: {e}, editing it with tomlkit instead")
+            section = self.get_or_create_section(section_name)
+            suggested = key not in section
+            if suggested:
+                section[key] = value
+            current = section[key]
+        if suggested:
             logger.info(f"pyproject.toml: suggesting [{section_name}]->{key}")
         if strongly:
-            if section[key] != value:
+            if current != value:
                 logger.info(
                     f"    Note: our suggested pyproject.toml value for [{section_name}]->{key}: {value}"
                 )
@@ -124,21 +254,25 @@ class PyprojectToml:
 
     def adjust_dev_packages(self):
         section_name = "dependency-groups"
-        self._suggest(
-            section_name,
-            "dev",
-            [
-                "pytest>=8.4.2",
-                "pytest-cov>=6.3.0",
-                "pytest-sugar>=1.1.1",
-            ],
-        )
+        self._suggest(section_name, "dev", DEV_PACKAGES)
+
+    def check_dev_packages_locked(self):
+        """Warn if our suggested dev packages are missing/outdated in uv.lock"""
+        check_uv_lock(self._project, DEV_PACKAGES, self.fs)
 
     def remove_old_sections(self):
         """Remove sections of old tools.
 
         For instance, isort had a `[tool.isort]` section. That's now obsoleted by ruff.
         """
+        original_text = self._current_text()
+        try:
+            self._text = toml_patch.remove_table(original_text, "tool.isort")
+            if self._text != original_text:
+                logger.info("Removed [tool.isort] section")
+            return
+        except toml_patch.UnsupportedLayoutError as e:
+            logger.debug(f"pyproject.toml: {e}, editing it with tomlkit instead")
         tool_super_section = self._contents.get("tool")
         if tool_super_section:
             if "isort" in tool_super_section:
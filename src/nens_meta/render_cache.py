@@ -0,0 +1,134 @@
+"""Purpose: only re-render the generated files whose inputs changed
+
+Per template, jinja2 tells us which variables it uses
+(`meta.find_undeclared_variables`). That dependency graph is stored, together with
+a fingerprint of the values of those variables per generated file and the mtime and
+size of the file as we left it. If the values and the file are still the same, the
+file doesn't need to be rendered again: changing `[meta_workflow]` only re-renders
+`.github/workflows/nens-meta.yml`.
+
+Like git's index, a file modified in the same instant the cache was written isn't
+trusted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import jinja2
+import jinja2.meta
+
+from nens_meta import __version__
+
+DEFAULT_FILE = Path.home() / ".cache" / "nens-meta" / "render-cache.json"
+CACHE_ENVVAR = "NENS_META_RENDER_CACHE"
+
+logger = logging.getLogger(__name__)
+
+
+def _stat(path: Path) -> list[int] | None:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class RenderCache:
+    """Template dependencies and input fingerprints of the files we generated"""
+
+    cache_file: Path
+    cache_mtime_ns: int
+    templates: dict[str, dict]
+    files: dict[str, dict]
+    pending: dict[Path, str]
+
+    def __init__(self, cache_file: Path, reuse: bool = True):
+        self.cache_file = cache_file
+        self.cache_mtime_ns = 0
+        self.templates = {}
+        self.files = {}
+        self.pending = {}
+        stored = self._load()
+        self.templates = stored.get("templates", {})
+        if reuse and stored:
+            self.files = stored.get("files", {})
+            self.cache_mtime_ns = cache_file.stat().st_mtime_ns
+
+    def _load(self) -> dict:
+        if not self.cache_file.exists():
+            return {}
+        try:
+            stored = json.loads(self.cache_file.read_text())
+        except ValueError:
+            logger.warning(f"Ignoring corrupt render cache {self.cache_file}")
+            return {}
+        if stored.get("version") != __version__:
+            # Our code might render differently now.
+            return {}
+        return stored
+
+    def variables(self, environment: jinja2.Environment, template_name: str) -> set:
+        """Return the variables the template uses"""
+        assert environment.loader is not None
+        source, _filename, _uptodate = environment.loader.get_source(
+            environment, template_name
+        )
+        source_hash = hashlib.sha1(source.encode()).hexdigest()
+        known = self.templates.get(template_name)
+        if known is None or known["hash"] != source_hash:
+            variables = jinja2.meta.find_undeclared_variables(environment.parse(source))
+            known = {"hash": source_hash, "variables": sorted(variables)}
+            self.templates[template_name] = known
+        return set(known["variables"])
+
+    def fingerprint(self, template_name: str, values: dict) -> str:
+        """Return a hash of the template and the values it's rendered with"""
+        inputs = {"template": self.templates[template_name]["hash"], "values": values}
+        as_json = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha1(as_json.encode()).hexdigest()
+
+    def is_fresh(self, target: Path, inputs: str) -> bool:
+        """Return True if the target was generated from the same inputs"""
+        entry = self.files.get(str(target.absolute()))
+        if entry is None or entry["inputs"] != inputs:
+            return False
+        if entry["stat"][0] >= self.cache_mtime_ns:
+            # "Racily clean": might have changed right after we stored the cache.
+            return False
+        return entry["stat"] == _stat(target)
+
+    def remember(self, target: Path, inputs: str):
+        """Store the inputs once the changes are written (see `save()`)"""
+        self.pending[target] = inputs
+
+    def save(self):
+        """Store the pending targets (as they're now on disk) in the cache file"""
+        # Other runs might have updated the cache in the meantime.
+        files = self._load().get("files", {})
+        for target, inputs in self.pending.items():
+            key = str(target.absolute())
+            stat = _stat(target)
+            if stat is None:
+                # Probably a .suggestion file got written instead.
+                files.pop(key, None)
+            else:
+                files[key] = {"inputs": inputs, "stat": stat}
+        self.pending = {}
+        self.files = files
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.cache_file.with_suffix(".tmp")
+        temp_file.write_text(
+            json.dumps(
+                {
+                    "version": __version__,
+                    "templates": self.templates,
+                    "files": files,
+                },
+                indent=1,
+                sort_keys=True,
+            )
+        )
+        os.replace(temp_file, self.cache_file)
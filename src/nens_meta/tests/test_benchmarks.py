@@ -0,0 +1,51 @@
+from pathlib import Path
+
+from pytest_mock.plugin import MockerFixture
+
+from nens_meta import benchmarks, nens_toml
+
+
+def test_benchmarks_work():
+    # Every benchmark can be set up and called (without timing it).
+    for name, bench in benchmarks.all_benchmarks().items():
+        bench()()
+    assert "content:meta_workflow" in benchmarks.all_benchmarks()
+
+
+def test_section_options_uncached(mocker: MockerFixture):
+    # The benchmark measures validating and merging, not a cache hit.
+    validate = mocker.spy(nens_toml, "validate")
+    bench = benchmarks.bench_section_options()
+    bench()
+    assert bench() == {"python_version": "3.12", "run_pytest": False}
+    assert validate.call_count == 4  # For Defaults() and section_options(), twice.
+
+
+def test_run():
+    results = benchmarks.run(["extract_extra_lines"], repeat=1)
+    assert list(results) == ["extract_extra_lines"]
+    assert results["extract_extra_lines"] > 0
+
+
+def test_baseline(tmp_path: Path):
+    baseline_file = tmp_path / "benchmarks.json"
+    assert benchmarks.load_baseline(baseline_file) == {}
+    benchmarks.save_baseline(baseline_file, {"a": 0.5})
+    assert benchmarks.load_baseline(baseline_file) == {"a": 0.5}
+
+
+def test_compare():
+    baseline = {"same": 1.0, "slower": 1.0, "much_slower": 1.0}
+    results = {"same": 1.0, "slower": 1.2, "much_slower": 2.0, "new": 1.0}
+    regressions = benchmarks.compare(results, baseline)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("much_slower: ")
+    assert len(benchmarks.compare(results, baseline, threshold=0.1)) == 2
+
+
+def test_committed_baseline():
+    # The committed baseline has all benchmarks.
+    assert benchmarks.in_source_checkout()
+    assert set(benchmarks.load_baseline(benchmarks.DEFAULT_BASELINE)) == set(
+        benchmarks.all_benchmarks()
+    )
@@ -0,0 +1,113 @@
+import logging
+from pathlib import Path
+
+import pytest
+from pytest_mock.plugin import MockerFixture
+
+from nens_meta import changeset, filesystem, utils
+
+
+def test_add1(tmp_path: Path):
+    # A new file is staged, but not yet written.
+    changes = changeset.ChangeSet()
+    changes.add(tmp_path / "sample.txt", "test", handle_extra_lines=False)
+    assert len(changes) == 1
+    assert not (tmp_path / "sample.txt").exists()
+
+
+def test_add2(tmp_path: Path):
+    # An unchanged file isn't staged.
+    f = tmp_path / "sample.txt"
+    f.write_text("test")
+    changes = changeset.ChangeSet()
+    changes.add(f, "test", handle_extra_lines=False)
+    assert not changes
+
+
+def test_add3(tmp_path: Path):
+    # Adding the same target again replaces the earlier change.
+    changes = changeset.ChangeSet()
+    changes.add(tmp_path / "sample.txt", "test1", handle_extra_lines=False)
+    changes.add(tmp_path / "sample.txt", "test2", handle_extra_lines=False)
+    assert [change.content for change in changes.changes] == ["test2"]
+
+
+def test_apply(tmp_path: Path):
+    changes = changeset.ChangeSet()
+    changes.add(tmp_path / "sub" / "dir" / "sample.txt", "test")
+    changes.apply()
+    content = (tmp_path / "sub" / "dir" / "sample.txt").read_text()
+    assert content.startswith("test")
+    assert utils.EXTRA_LINES_MARKER in content
+
+
+def test_apply_rollback(tmp_path: Path, mocker: MockerFixture):
+    # If the second write fails, the first file is restored and the created dirs
+    # are removed again.
+    existing = tmp_path / "existing.txt"
+    existing.write_text("original")
+    changes = changeset.ChangeSet()
+    changes.add(existing, "changed", handle_extra_lines=False)
+    changes.add(tmp_path / "new" / "new.txt", "new", handle_extra_lines=False)
+    changes.add(tmp_path / "other" / "broken.txt", "broken", handle_extra_lines=False)
+
+    original_write_text = Path.write_text
+
+    def failing_write_text(path: Path, content: str):
+        if path.name == "broken.txt":
+            raise OSError("Disk full")
+        return original_write_text(path, content)
+
+    mocker.patch.object(Path, "write_text", failing_write_text)
+    with pytest.raises(OSError):
+        changes.apply()
+    assert existing.read_text() == "original"
+    assert not (tmp_path / "new").exists()
+    assert not (tmp_path / "other").exists()
+
+
+def test_add4(tmp_path: Path):
+    # A leave-alone file is staged as .suggestion, adding it again replaces that.
+    f = tmp_path / "sample.txt"
+    f.write_text(utils.LEAVE_ALONE_MARKER)
+    changes = changeset.ChangeSet()
+    changes.add(f, "test1", handle_extra_lines=False)
+    changes.add(f, "test2", handle_extra_lines=False)
+    assert [change.target.name for change in changes.changes] == [
+        "sample.txt.suggestion"
+    ]
+    assert [change.content for change in changes.changes] == ["test2"]
+
+
+def test_apply_rollback_mkdir(tmp_path: Path, mocker: MockerFixture):
+    # If creating a nested directory fails, its already-created parent is removed.
+    changes = changeset.ChangeSet()
+    changes.add(tmp_path / "sub" / "broken" / "new.txt", "new")
+
+    original_mkdir = Path.mkdir
+
+    def failing_mkdir(path: Path, *args, **kwargs):
+        if path.name == "broken":
+            raise OSError("Permission denied")
+        return original_mkdir(path, *args, **kwargs)
+
+    mocker.patch.object(Path, "mkdir", failing_mkdir)
+    with pytest.raises(OSError):
+        changes.apply()
+    assert not (tmp_path / "sub").exists()
+
+
+def test_apply_logging(tmp_path: Path, caplog: pytest.LogCaptureFixture):
+    # Writes to an in-memory filesystem aren't reported as real writes.
+    caplog.set_level(logging.INFO)
+    changes = changeset.ChangeSet(filesystem.MemoryFilesystem({}))
+    changes.add(tmp_path / "sub" / "sample.txt", "test")
+    changes.apply()
+    assert not caplog.records
+    changes = changeset.ChangeSet()
+    changes.add(tmp_path / "sub" / "sample.txt", "test")
+    changes.apply()
+    assert [record.getMessage().split()[0] for record in caplog.records] == [
+        "Created",
+        "Wrote",
+    ]
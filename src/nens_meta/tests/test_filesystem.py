@@ -0,0 +1,102 @@
+from pathlib import Path
+
+import pytest
+
+from nens_meta import filesystem, nens_toml, update_project
+
+
+def test_disk(tmp_path: Path):
+    fs = filesystem.DISK
+    fs.mkdir(tmp_path / "sub")
+    fs.write_text(tmp_path / "sub" / "sample.py", "test")
+    assert fs.is_dir(tmp_path / "sub")
+    assert fs.read_text(tmp_path / "sub" / "sample.py") == "test"
+    assert list(fs.rglob(tmp_path, "*.py")) == [tmp_path / "sub" / "sample.py"]
+    assert list(fs.glob(tmp_path, "*.py")) == []
+    fs.unlink(tmp_path / "sub" / "sample.py")
+    fs.rmdir(tmp_path / "sub")
+    assert not fs.exists(tmp_path / "sub")
+
+
+def test_memory1():
+    fs = filesystem.MemoryFilesystem({Path("sub/sample.py"): "test"})
+    assert fs.exists(Path("sub"))
+    assert fs.is_dir(Path("sub"))
+    assert fs.is_dir(Path("."))
+    assert not fs.is_dir(Path("sub/sample.py"))
+    assert fs.read_text(Path("sub/sample.py")) == "test"
+    assert list(fs.rglob(Path("."), "*.py")) == [Path("sub/sample.py")]
+    assert list(fs.glob(Path("."), "*.py")) == []
+    assert list(fs.glob(Path("sub"), "*.py")) == [Path("sub/sample.py")]
+
+
+def test_memory2():
+    # Errors like on a real filesystem.
+    fs = filesystem.MemoryFilesystem({Path("sub/sample.py"): "test"})
+    with pytest.raises(FileNotFoundError):
+        fs.read_text(Path("missing.txt"))
+    with pytest.raises(IsADirectoryError):
+        fs.write_text(Path("sub"), "test")
+    with pytest.raises(FileExistsError):
+        fs.mkdir(Path("sub"))
+    with pytest.raises(OSError):
+        fs.rmdir(Path("sub"))
+    fs.unlink(Path("sub/sample.py"))
+    fs.rmdir(Path("sub"))
+    assert not fs.exists(Path("sub"))
+
+
+def test_overlay(tmp_path: Path):
+    (tmp_path / "original.txt").write_text("original")
+    (tmp_path / "removed.txt").write_text("removed")
+    fs = filesystem.OverlayFilesystem(filesystem.DISK)
+    fs.write_text(tmp_path / "original.txt", "changed")
+    fs.write_text(tmp_path / "new.txt", "new")
+    fs.unlink(tmp_path / "removed.txt")
+    fs.mkdir(tmp_path / "sub")
+    assert fs.read_text(tmp_path / "original.txt") == "changed"
+    assert fs.is_dir(tmp_path / "sub")
+    assert fs.is_dir(tmp_path)
+    assert not fs.exists(tmp_path / "removed.txt")
+    with pytest.raises(FileNotFoundError):
+        fs.read_text(tmp_path / "removed.txt")
+    with pytest.raises(FileExistsError):
+        fs.mkdir(tmp_path / "sub")
+    assert sorted(fs.glob(tmp_path, "*.txt")) == [
+        tmp_path / "new.txt",
+        tmp_path / "original.txt",
+    ]
+    assert sorted(fs.rglob(tmp_path, "*.txt")) == [
+        tmp_path / "new.txt",
+        tmp_path / "original.txt",
+    ]
+    fs.rmdir(tmp_path / "sub")
+    assert not fs.exists(tmp_path / "sub")
+    # The real files are untouched.
+    assert (tmp_path / "original.txt").read_text() == "original"
+    assert (tmp_path / "removed.txt").exists()
+    assert not (tmp_path / "new.txt").exists()
+    assert set(fs.changed_files()) == {tmp_path / "original.txt", tmp_path / "new.txt"}
+
+
+def test_project_in_memory():
+    # A complete project can be generated without touching the disk.
+    project_dir = Path("example")
+    fs = filesystem.MemoryFilesystem({project_dir / "example" / "__init__.py": ""})
+    nens_toml.create_if_missing(project_dir, fs)
+    our_config = nens_toml.OurConfig(project_dir, fs)
+    update_project.plan_changes(project_dir, our_config).apply()
+    assert "geojson" in fs.read_text(project_dir / ".editorconfig")
+    assert "ruff" in fs.read_text(project_dir / "pyproject.toml")
+    assert fs.exists(project_dir / ".github" / "workflows" / "nens-meta.yml")
+
+
+def test_iter_lines(tmp_path: Path):
+    (tmp_path / "disk.txt").write_text("a\nb\n")
+    fs = filesystem.OverlayFilesystem(filesystem.DISK)
+    fs.write_text(tmp_path / "memory.txt", "c\nd\n")
+    assert list(fs.iter_lines(tmp_path / "disk.txt")) == ["a\n", "b\n"]
+    assert list(fs.iter_lines(tmp_path / "memory.txt")) == ["c\n", "d\n"]
+    fs.unlink(tmp_path / "disk.txt")
+    with pytest.raises(FileNotFoundError):
+        fs.iter_lines(tmp_path / "disk.txt")
@@ -0,0 +1,106 @@
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from nens_meta import fleet_index, nens_toml
+
+TARGETS = [".editorconfig"]
+
+
+@pytest.fixture
+def fleet(tmp_path: Path) -> Iterator[fleet_index.FleetIndex]:
+    fleet = fleet_index.FleetIndex(tmp_path / "index" / "fleet.sqlite3")
+    yield fleet
+    fleet.close()
+
+
+def make_repo(path: Path, nens_toml_content: str) -> Path:
+    path.mkdir()
+    nens_toml.nens_toml_file(path).write_text(nens_toml_content)
+    (path / ".editorconfig").write_text("root = true\n")
+    return path
+
+
+def test_parse_condition():
+    assert fleet_index.parse_condition("python_version = 3.11") == (
+        "python_version",
+        "3.11",
+    )
+    assert fleet_index.parse_condition("run_pytest=True") == ("run_pytest", True)
+    with pytest.raises(ValueError):
+        fleet_index.parse_condition("run_pytest")
+
+
+def test_update1(tmp_path: Path, fleet: fleet_index.FleetIndex):
+    repo = make_repo(
+        tmp_path / "repo",
+        '[meta]\nproject_name = "repo"\n[meta_workflow]\npython_version = "3.11"\n',
+    )
+    assert fleet.update(repo, TARGETS)
+    # Nothing changed, so no re-indexing.
+    assert not fleet.update(repo, TARGETS)
+    (repo / ".editorconfig").write_text("root = false\n")
+    assert fleet.update(repo, TARGETS)
+    [row] = fleet.repos(python_version="3.11")
+    assert row["project_name"] == "repo"
+    assert row["uses_python"] == 0
+    [generated_file] = fleet.connection.execute("select * from generated_files")
+    assert generated_file["target"] == ".editorconfig"
+
+
+def test_update2(tmp_path: Path, fleet: fleet_index.FleetIndex):
+    # Without .nens.toml, there's nothing to index.
+    (tmp_path / "repo").mkdir()
+    assert not fleet.update(tmp_path / "repo", TARGETS)
+
+
+def test_update_defaults(tmp_path: Path, fleet: fleet_index.FleetIndex):
+    # Options missing from .nens.toml come from the defaults, changing those
+    # re-indexes the repo.
+    repo = make_repo(tmp_path / "repo", "")
+    defaults = nens_toml.Defaults({"meta_workflow": {"python_version": "3.11"}})
+    assert fleet.update(repo, TARGETS, defaults)
+    assert not fleet.update(repo, TARGETS, defaults)
+    assert fleet.repos()[0]["python_version"] == "3.11"
+    defaults = nens_toml.Defaults({"meta_workflow": {"python_version": "3.13"}})
+    assert fleet.update(repo, TARGETS, defaults)
+    assert fleet.repos()[0]["python_version"] == "3.13"
+
+
+def test_update_invalid(tmp_path: Path, fleet: fleet_index.FleetIndex):
+    repo = make_repo(tmp_path / "repo", "[meta]\nuses_python = 1\n")
+    with pytest.raises(nens_toml.ValidationError):
+        fleet.update(repo, TARGETS)
+
+
+def test_repos(tmp_path: Path, fleet: fleet_index.FleetIndex):
+    # The meta_version pinned in .nens.toml is stored, not our own version.
+    for name, version in [("new", "1.10"), ("old", "0.9"), ("middle", "1.2")]:
+        repo = make_repo(tmp_path / name, f'[meta]\nmeta_version = "{version}"\n')
+        fleet.update(repo, TARGETS)
+    assert [row["meta_version"] for row in fleet.repos()] == ["0.9", "1.2", "1.10"]
+    assert len(fleet.repos(run_pytest=False)) == 3
+    with pytest.raises(ValueError):
+        fleet.repos(path="/etc")
+
+
+def test_record_run(tmp_path: Path, fleet: fleet_index.FleetIndex):
+    repo = make_repo(tmp_path / "repo", "")
+    fleet.update(repo, TARGETS)
+    fleet.record_run(repo, 1.5)
+    assert fleet.repos()[0]["last_run_seconds"] == 1.5
+
+
+def test_update_many(tmp_path: Path, fleet: fleet_index.FleetIndex):
+    # Broken repos are reported, the ones after them are still indexed.
+    repos = [
+        make_repo(tmp_path / "good1", ""),
+        make_repo(tmp_path / "invalid", '[meta_workflow]\nrun_pytest = "yes"\n'),
+        make_repo(tmp_path / "unparsable", "[meta\n"),
+        make_repo(tmp_path / "good2", ""),
+    ]
+    changed, errors = fleet.update_many(repos, TARGETS)
+    assert changed == 2
+    assert list(errors) == [repos[1], repos[2]]
+    assert len(fleet.repos()) == 2
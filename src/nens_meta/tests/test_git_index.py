@@ -0,0 +1,116 @@
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock.plugin import MockerFixture
+
+from nens_meta import filesystem, git_index, utils
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    (tmp_path / "sub").mkdir()
+    for name in ["sample.txt", "sub/other.txt"]:
+        (tmp_path / name).write_text(f"test\n\n{utils.EXTRA_LINES_MARKER}")
+        # Prevent a "racily clean" index entry.
+        os.utime(tmp_path / name, (1_000_000_000, 1_000_000_000))
+    subprocess.run(["git", "-C", str(tmp_path), "add", "."], check=True)
+    return tmp_path
+
+
+def test_blob_hash():
+    # Same as "git hash-object" of an empty file.
+    assert git_index.blob_hash(b"") == "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+
+
+@pytest.mark.parametrize("version", ["2", "3", "4"])
+def test_parse_index(repo: Path, version: str):
+    subprocess.run(
+        ["git", "-C", str(repo), "update-index", "--index-version", version],
+        check=True,
+    )
+    entries = git_index.parse_index((repo / ".git" / "index").read_bytes())
+    assert set(entries) == {"sample.txt", "sub/other.txt"}
+    content = (repo / "sub" / "other.txt").read_bytes()
+    assert entries["sub/other.txt"].sha == git_index.blob_hash(content)
+
+
+def test_parse_index_unsupported():
+    with pytest.raises(ValueError):
+        git_index.parse_index(b"DIRC\0\0\0\x01\0\0\0\0")
+
+
+def test_is_unchanged1(repo: Path):
+    content = f"test\n\n{utils.EXTRA_LINES_MARKER}"
+    assert git_index.is_unchanged(repo / "sample.txt", content)
+    assert git_index.is_unchanged(repo / "sub" / "other.txt", content)
+    assert not git_index.is_unchanged(repo / "sample.txt", "other content")
+    assert not git_index.is_unchanged(repo / "missing.txt", content)
+
+
+def test_is_unchanged2(repo: Path):
+    # A changed worktree file isn't trusted, even with the same size.
+    (repo / "sample.txt").write_text(f"TEST\n\n{utils.EXTRA_LINES_MARKER}")
+    content = f"test\n\n{utils.EXTRA_LINES_MARKER}"
+    assert not git_index.is_unchanged(repo / "sample.txt", content)
+
+
+def test_is_unchanged3(tmp_path: Path):
+    # No git, no index.
+    assert not git_index.is_unchanged(tmp_path / "sample.txt", "test")
+
+
+def test_worktree_gitdir_file(repo: Path, tmp_path_factory: pytest.TempPathFactory):
+    worktree = tmp_path_factory.mktemp("worktree")
+    (worktree / ".git").write_text(f"gitdir: {repo / '.git'}\n")
+    (worktree / "dummy.txt").write_text("")
+    assert git_index.index_for(worktree / "dummy.txt") is not None
+
+
+def test_planned_write_skips_reading(repo: Path, mocker: MockerFixture):
+    git_index.index_for(repo / "sample.txt")  # Load the index.
+    reader = mocker.spy(Path, "read_text")
+    assert utils.planned_write(repo / "sample.txt", "test\n") is None
+    reader.assert_not_called()
+    # With a different content, the file is read.
+    assert utils.planned_write(repo / "sample.txt", "other\n") is not None
+    reader.assert_called()
+
+
+def test_read_varint():
+    assert git_index._read_varint(bytes([0x05]), 0) == (5, 1)
+    # 0x80 0x00 is 128 in git's offset encoding.
+    assert git_index._read_varint(bytes([0x80, 0x00]), 0) == (128, 2)
+
+
+def test_racily_clean(repo: Path):
+    # An entry that is as new as the index itself isn't trusted.
+    (repo / "new.txt").write_text("new")
+    subprocess.run(["git", "-C", str(repo), "add", "new.txt"], check=True)
+    index = git_index.index_for(repo / "new.txt")
+    assert index is not None
+    index.entries["new.txt"].mtime_ns = index.index_mtime_ns
+    assert not index.is_unchanged(repo / "new.txt", "new")
+
+
+def test_removed_file(repo: Path):
+    index = git_index.index_for(repo / "sample.txt")
+    assert index is not None
+    (repo / "sample.txt").unlink()
+    assert not index.is_unchanged(repo / "sample.txt", "test")
+
+
+def test_corrupt_index(tmp_path: Path):
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "index").write_bytes(b"garbage")
+    assert git_index.index_for(tmp_path / "sample.txt") is None
+
+
+def test_overlay(repo: Path):
+    fs = filesystem.OverlayFilesystem(filesystem.DISK)
+    content = f"test\n\n{utils.EXTRA_LINES_MARKER}"
+    assert fs.known_to_contain(repo / "sample.txt", content)
+    fs.write_text(repo / "sample.txt", content)
+    assert not fs.known_to_contain(repo / "sample.txt", content)
@@ -0,0 +1,61 @@
+from pathlib import Path
+
+import pytest
+
+from nens_meta import journal
+
+
+def test_input_fingerprint():
+    assert journal.input_fingerprint("1.0", {"a": 1}) == journal.input_fingerprint(
+        "1.0", {"a": 1}
+    )
+    assert journal.input_fingerprint("1.0") != journal.input_fingerprint("1.1")
+
+
+def test_parse_shard():
+    assert journal.parse_shard("2/5") == (2, 5)
+    for wrong in ["2", "0/5", "6/5", "a/b"]:
+        with pytest.raises(ValueError):
+            journal.parse_shard(wrong)
+
+
+def test_in_shard():
+    repos = [Path(f"/repos/repo{number}") for number in range(20)]
+    assert journal.in_shard(repos, None) == repos
+    shards = [journal.in_shard(repos, f"{index}/3") for index in (1, 2, 3)]
+    assert sorted(sum(shards, [])) == sorted(repos)
+    assert all(shards)
+    # Deterministic, and only based on the directory name.
+    moved = [Path("/elsewhere") / repo.name for repo in shards[0]]
+    assert journal.in_shard(moved, "1/3") == moved
+
+
+def test_journal(tmp_path: Path):
+    journal_file = tmp_path / "run" / "journal.jsonl"
+    run_journal = journal.Journal(journal_file)
+    repo = tmp_path / "repo"
+    assert not run_journal.is_done(repo, "abc")
+    run_journal.record(repo, "abc", journal.DONE, "up to date")
+    assert run_journal.is_done(repo, "abc")
+    assert not run_journal.is_done(repo, "def")
+    assert run_journal.outcome(repo) == "up to date"
+    # Read back.
+    assert journal.Journal(journal_file).is_done(repo, "abc")
+    assert journal.Journal(journal_file).outcome(repo) == "up to date"
+    # A later error means it isn't done anymore.
+    run_journal.record(repo, "abc", journal.ERROR, "Oops")
+    assert not run_journal.is_done(repo, "abc")
+    assert not journal.Journal(journal_file).is_done(repo, "abc")
+
+
+def test_journal_interrupted(tmp_path: Path):
+    journal_file = tmp_path / "journal.jsonl"
+    repo = tmp_path / "repo"
+    journal.Journal(journal_file).record(repo, "abc", journal.DONE, "")
+    with journal_file.open("a") as f:
+        f.write('{"repo": "/half/writ')
+    run_journal = journal.Journal(journal_file)
+    assert run_journal.is_done(repo, "abc")
+    other = tmp_path / "other"
+    run_journal.record(other, "def", journal.DONE, "")
+    assert journal.Journal(journal_file).is_done(other, "def")
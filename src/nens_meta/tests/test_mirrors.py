@@ -0,0 +1,129 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from nens_meta import journal, mirrors, nens_toml, update_project
+
+
+def git(*args: str, cwd: Path):
+    subprocess.run(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com", *args],
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+def make_mirror(tmp_path: Path, files: dict[str, str], update: bool = False) -> Path:
+    checkout = tmp_path / "checkout"
+    checkout.mkdir()
+    git("init", "-q", cwd=checkout)
+    for name, content in files.items():
+        (checkout / name).parent.mkdir(parents=True, exist_ok=True)
+        (checkout / name).write_text(content)
+    if update:
+        nens_toml.create_if_missing(checkout)
+        our_config = nens_toml.OurConfig(checkout)
+        update_project.plan_changes(checkout, our_config).apply()
+    git("add", "-A", cwd=checkout)
+    git("commit", "-q", "-m", "Initial", cwd=checkout)
+    git(
+        "clone",
+        "-q",
+        "--mirror",
+        str(checkout),
+        str(tmp_path / "repo.git"),
+        cwd=tmp_path,
+    )
+    return tmp_path / "repo.git"
+
+
+def test_tree_entries():
+    data = b"100644 a.txt\0" + b"\x01" * 20 + b"40000 src\0" + b"\x02" * 20
+    assert list(mirrors.tree_entries(data)) == [
+        (b"100644", "a.txt", "01" * 20),
+        (b"40000", "src", "02" * 20),
+    ]
+
+
+def test_cat_file(tmp_path: Path):
+    mirror = make_mirror(tmp_path, {"src/example.py": "print(1)\n"})
+    with mirrors.CatFile(mirror) as cat_file:
+        assert cat_file.get(["HEAD:src/example.py", "HEAD:missing.txt"]) == [
+            b"print(1)\n",
+            None,
+        ]
+        assert list(cat_file.list_tree("HEAD")) == ["src/example.py"]
+        with pytest.raises(ValueError):
+            cat_file.list_tree("no-such-branch")
+
+
+def test_mirror_filesystem(tmp_path: Path):
+    mirror = make_mirror(tmp_path, {"README.md": "Hi\n", "src/example.py": ""})
+    project = Path("/repo")
+    with mirrors.CatFile(mirror) as cat_file:
+        fs = mirrors.MirrorFilesystem(cat_file, "HEAD", project, ["README.md"])
+        assert fs.contents == {"README.md": "Hi\n"}
+        assert fs.is_dir(project / "src")
+        assert fs.exists(project / "src" / "example.py")
+        assert not fs.exists(project / "setup.py")
+        assert fs.read_text(project / "src" / "example.py") == ""
+        assert list(fs.iter_lines(project / "README.md")) == ["Hi\n"]
+        with pytest.raises(FileNotFoundError):
+            fs.read_text(project / "setup.py")
+        assert list(fs.glob(project, "*.md")) == [project / "README.md"]
+        assert list(fs.rglob(project, "*.py")) == [project / "src" / "example.py"]
+        assert fs.known_to_contain(project / "README.md", "Hi\n")
+        for method in (fs.unlink, fs.mkdir, fs.rmdir):
+            with pytest.raises(PermissionError):
+                method(project / "README.md")
+        with pytest.raises(PermissionError):
+            fs.write_text(project / "README.md", "")
+
+
+def test_audit_mirror_drift(tmp_path: Path):
+    mirror = make_mirror(tmp_path, {"README.md": "Hi\n"})
+    result = mirrors.audit_mirror(mirror)
+    assert result.error is None
+    assert ".nens.toml" in result.drifted
+    assert ".gitignore" in result.drifted
+
+
+def test_audit_mirror_up_to_date(tmp_path: Path):
+    mirror = make_mirror(tmp_path, {"ansible/site.yml": ""}, update=True)
+    assert mirrors.audit_mirror(mirror).drifted == []
+
+
+def test_audit_mirror_error(tmp_path: Path):
+    mirror = make_mirror(tmp_path, {".nens.toml": "[meta_workflow]\nrun_pytest = 1\n"})
+    error = mirrors.audit_mirror(mirror).error
+    assert error is not None
+    assert "run_pytest" in error
+    error = mirrors.audit_mirror(mirror, ref="nope").error
+    assert error is not None
+    assert "not found" in error
+
+
+def test_audit_mirror_journal(tmp_path: Path):
+    mirror = make_mirror(tmp_path, {"README.md": "Hi\n"})
+    run_journal = journal.Journal(tmp_path / "journal.jsonl")
+    result = mirrors.audit_mirror(mirror, run_journal=run_journal, resume=True)
+    assert result.drifted
+    # A skipped mirror still reports the drift found earlier.
+    resumed = mirrors.audit_mirror(mirror, run_journal=run_journal, resume=True)
+    assert resumed.skipped
+    assert resumed.drifted == result.drifted
+    # Also when read back from the journal file.
+    run_journal = journal.Journal(tmp_path / "journal.jsonl")
+    resumed = mirrors.audit_mirror(mirror, run_journal=run_journal, resume=True)
+    assert resumed.drifted == result.drifted
+    assert not mirrors.audit_mirror(mirror, run_journal=run_journal).skipped
+    # Errors are recorded, but don't count as done.
+    broken = mirrors.audit_mirror(
+        mirror, ref="nope", run_journal=run_journal, resume=True
+    )
+    assert broken.error
+    assert not mirrors.audit_mirror(
+        mirror, ref="nope", run_journal=run_journal, resume=True
+    ).skipped
@@ -136,3 +136,175 @@ def test_update_meta_options4(tmp_path: Path):
 
 def test_write_documentation():
     nens_toml.write_documentation()
+
+
+def test_defaults1(tmp_path: Path):
+    # Shared defaults are used when .nens.toml doesn't set the option.
+    defaults_file = tmp_path / "defaults.toml"
+    defaults_file.write_text('[meta_workflow]\npython_version = "3.13"\n')
+    defaults = nens_toml.load_defaults(defaults_file)
+    nens_toml.nens_toml_file(tmp_path).write_text("")
+    config = nens_toml.OurConfig(tmp_path, defaults=defaults)
+    assert config.section_options("meta_workflow")["python_version"] == "3.13"
+    # The defaults file is only parsed once.
+    assert nens_toml.load_defaults(defaults_file) is defaults
+
+
+def test_defaults2(tmp_path: Path):
+    # .nens.toml wins over the shared defaults.
+    defaults = nens_toml.Defaults({"meta_workflow": {"python_version": "3.13"}})
+    nens_toml.nens_toml_file(tmp_path).write_text(
+        """
+    [meta_workflow]
+    python_version = "3.11"
+    """
+    )
+    config = nens_toml.OurConfig(tmp_path, defaults=defaults)
+    assert config.section_options("meta_workflow")["python_version"] == "3.11"
+
+
+def test_defaults3(tmp_path: Path):
+    # The defaults are validated.
+    with pytest.raises(ValueError):
+        nens_toml.Defaults({"meta_workflow": {"run_pytest": "yes"}})
+    # Unknown keys and sections are only warned about, like `validate` does.
+    defaults = nens_toml.Defaults({"meta_workflow": {"year": 1972}, "tool": 1})
+    assert "year" in defaults.sections["meta_workflow"]
+    assert "tool" not in defaults.sections
+    defaults_file = tmp_path / "defaults.toml"
+    defaults_file.write_text("tool = 1\n[meta_workflow]\nyear = 1972\n")
+    errors, warnings = nens_toml.validate_file(defaults_file)
+    assert errors == []
+    assert len(warnings) == 2
+
+
+def test_defaults_cache(tmp_path: Path):
+    # The merged options are cached per .nens.toml content.
+    defaults = nens_toml.Defaults({"meta_workflow": {"run_pytest": True}})
+    nens_toml.nens_toml_file(tmp_path).write_text("")
+    config = nens_toml.OurConfig(tmp_path, defaults=defaults)
+    options = config.section_options("meta_workflow")
+    options["run_pytest"] = False  # Changing the result doesn't affect the cache.
+    assert defaults.merged_cache is not None
+    assert len(defaults.merged_cache) == 1
+    assert config.section_options("meta_workflow")["run_pytest"] is True
+    nens_toml.nens_toml_file(tmp_path).write_text("[meta_workflow]\nrun_pytest = false")
+    config = nens_toml.OurConfig(tmp_path, defaults=defaults)
+    assert config.section_options("meta_workflow")["run_pytest"] is False
+    assert len(defaults.merged_cache) == 2
+
+
+def test_defaults_cache_shared(tmp_path: Path):
+    # Projects with the same section share the cache entry.
+    defaults = nens_toml.Defaults({})
+    for name in ["one", "two"]:
+        (tmp_path / name).mkdir()
+        nens_toml.nens_toml_file(tmp_path / name).write_text(
+            f'[meta]\nproject_name = "{name}"\n[meta_workflow]\nrun_pytest = true\n'
+        )
+        config = nens_toml.OurConfig(tmp_path / name, defaults=defaults)
+        assert config.section_options("meta_workflow")["run_pytest"] is True
+    assert defaults.merged_cache is not None
+    assert len(defaults.merged_cache) == 1
+
+
+def test_defaults_cache_copies(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Lists in the cached options aren't shared with the returned options.
+    option = nens_toml.Option(
+        key="names", description="Names", default=[], value_type=list[str]
+    )
+    compiled = nens_toml.compile_schema({"listy": [option]})
+    monkeypatch.setitem(nens_toml.SCHEMA, "listy", compiled["listy"])
+    defaults = nens_toml.Defaults({})
+    nens_toml.nens_toml_file(tmp_path).write_text('[listy]\nnames = ["reinout"]\n')
+    config = nens_toml.OurConfig(tmp_path, defaults=defaults)
+    options = config.section_options("listy")
+    options["names"].append("guido")
+    assert config.section_options("listy")["names"] == ["reinout"]
+
+
+def test_defaults_cache_size(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(nens_toml, "MERGED_CACHE_SIZE", 2)
+    defaults = nens_toml.Defaults({})
+    nens_toml.nens_toml_file(tmp_path).write_text("")
+    config = nens_toml.OurConfig(tmp_path, defaults=defaults)
+    for section_name in ["meta", "meta_workflow", "gitignore"]:
+        config.section_options(section_name)
+    assert defaults.merged_cache is not None
+    assert [section for section, _hash in defaults.merged_cache] == [
+        "meta_workflow",
+        "gitignore",
+    ]
+
+
+def test_no_defaults_cache(tmp_path: Path):
+    # The module-level NO_DEFAULTS, shared by everything, doesn't cache.
+    nens_toml.nens_toml_file(tmp_path).write_text("")
+    config = nens_toml.OurConfig(tmp_path)
+    config.section_options("meta")
+    assert nens_toml.NO_DEFAULTS.merged_cache is None
+
+
+def test_compile_check():
+    assert nens_toml._compile_check(str)("a")
+    assert not nens_toml._compile_check(str)(1)
+    assert nens_toml._compile_check(int)(3)
+    assert not nens_toml._compile_check(int)(True)
+    assert nens_toml._compile_check(list[str])(["a", "b"])
+    assert not nens_toml._compile_check(list[str])(["a", 1])
+    assert not nens_toml._compile_check(list[str])("a")
+
+
+def test_validate():
+    contents = {
+        "meta": {"uses_python": "yes", "uses_ansible": 1, "year": 1972},
+        "meta_workflow": {"run_pytest": True},
+        "gitignore": "wrong",
+        "reinout": {"year": 1972},
+    }
+    # All errors are reported at once.
+    assert nens_toml.validate(contents) == [
+        "[meta] uses_python should be of type bool, not str",
+        "[meta] uses_ansible should be of type bool, not int",
+        "[gitignore] should be a table",
+    ]
+    assert nens_toml.unknown_options(contents) == [
+        "[meta] year is not known",
+        "[reinout] is not known",
+    ]
+
+
+def test_validation_error(tmp_path: Path):
+    nens_toml.nens_toml_file(tmp_path).write_text(
+        "[meta]\nuses_python = 1\n[meta_workflow]\nrun_pytest = 1\n"
+    )
+    config = nens_toml.OurConfig(tmp_path)
+    with pytest.raises(nens_toml.ValidationError) as excinfo:
+        config.section_options("gitignore")
+    assert len(excinfo.value.errors) == 2
+
+
+def test_validate_file(tmp_path: Path):
+    config_file = tmp_path / ".nens.toml"
+    assert "Cannot read" in nens_toml.validate_file(config_file)[0][0]
+    config_file.write_text("[meta\n")
+    assert "Cannot read" in nens_toml.validate_file(config_file)[0][0]
+    config_file.write_text("[meta_workflow]\nrun_pytest = 1\npython = '3.12'\n")
+    assert nens_toml.validate_file(config_file) == (
+        ["[meta_workflow] run_pytest should be of type bool, not int"],
+        ["[meta_workflow] python is not known"],
+    )
+
+
+def test_json_schema():
+    schema = nens_toml.json_schema()
+    run_pytest = schema["properties"]["meta_workflow"]["properties"]["run_pytest"]
+    assert run_pytest["type"] == "boolean"
+    assert run_pytest["default"] is False
+    # Unknown sections and options are only warnings, so the schema allows them.
+    assert "additionalProperties" not in schema
+    assert "additionalProperties" not in schema["properties"]["meta_workflow"]
+    assert nens_toml._json_schema_type(list[str]) == {
+        "type": "array",
+        "items": {"type": "string"},
+    }
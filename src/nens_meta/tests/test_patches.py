@@ -0,0 +1,135 @@
+import json
+import subprocess
+from pathlib import Path
+
+import pytest
+from pytest_mock.plugin import MockerFixture
+
+from nens_meta import journal, nens_toml, patches
+from nens_meta.nens_toml import NO_DEFAULTS
+
+
+def make_repo(path: Path) -> Path:
+    path.mkdir(parents=True)
+    subprocess.run(["git", "init", "-q", str(path)], check=True)
+    (path / ".gitignore").write_text("# Old gitignore\n/var/")
+    return path
+
+
+def test_file_diff_new_file():
+    diff = patches.file_diff("a.txt", None, "one\n")
+    assert diff.startswith("diff --git a/a.txt b/a.txt\nnew file mode 100644\n")
+    assert "--- /dev/null\n+++ b/a.txt\n" in diff
+    assert diff.endswith("+one\n")
+
+
+def test_file_diff_no_newline():
+    diff = patches.file_diff("a.txt", "one", "one\n")
+    assert "-one\n\\ No newline at end of file\n+one\n" in diff
+
+
+def test_repo_patch(tmp_path: Path):
+    repo = make_repo(tmp_path / "repo")
+    patch = patches.repo_patch(repo)
+    assert "diff --git a/.nens.toml b/.nens.toml" in patch
+    assert "-/var/\n\\ No newline at end of file\n" in patch
+    # The checkout itself is left alone.
+    assert not nens_toml.nens_toml_file(repo).exists()
+    assert (repo / ".gitignore").read_text() == "# Old gitignore\n/var/"
+    # And the patch applies cleanly.
+    (tmp_path / "repo.patch").write_text(patch)
+    subprocess.run(["git", "apply", str(tmp_path / "repo.patch")], cwd=repo, check=True)
+    assert patches.repo_patch(repo) == ""
+
+
+def test_write_patches(tmp_path: Path):
+    repos = [
+        make_repo(tmp_path / "one" / "repo"),
+        make_repo(tmp_path / "two" / "repo"),
+    ]
+    output_dir = tmp_path / "patches"
+    result = patches.write_patches(repos, output_dir, workers=1)
+    assert sorted(path.name for path in result.values()) == [
+        "repo-2.patch",
+        "repo.patch",
+    ]
+    # Up-to-date repos don't get a patch.
+    subprocess.run(["git", "apply", str(result[repos[0]])], cwd=repos[0], check=True)
+    assert list(patches.write_patches(repos, output_dir, workers=2)) == [repos[1]]
+
+
+def test_write_patches_journal(tmp_path: Path):
+    repos = [make_repo(tmp_path / "good"), make_repo(tmp_path / "bad")]
+    nens_toml.nens_toml_file(repos[1]).write_text("[meta]\nuses_python = 1\n")
+    output_dir = tmp_path / "patches"
+    run_journal = journal.Journal(output_dir / "journal.jsonl")
+    result = patches.write_patches(
+        repos, output_dir, workers=1, run_journal=run_journal
+    )
+    assert list(result) == [repos[0]]
+    assert run_journal.is_done(
+        repos[0], patches.repo_fingerprint(repos[0], NO_DEFAULTS)
+    )
+    assert not run_journal.is_done(
+        repos[1], patches.repo_fingerprint(repos[1], NO_DEFAULTS)
+    )
+    # Resuming only retries the failed repo.
+    nens_toml.nens_toml_file(repos[1]).write_text("")
+    result = patches.write_patches(
+        repos, output_dir, workers=1, run_journal=run_journal, resume=True
+    )
+    assert list(result) == [repos[1]]
+    # Without changes, resuming does nothing.
+    assert (
+        patches.write_patches(
+            repos, output_dir, workers=1, run_journal=run_journal, resume=True
+        )
+        == {}
+    )
+
+
+def test_repo_patch_no_repo(tmp_path: Path):
+    with pytest.raises(ValueError, match="doesn't exist"):
+        patches.repo_patch(tmp_path / "does-not-exist")
+    (tmp_path / "no-git").mkdir()
+    with pytest.raises(ValueError, match="no .git"):
+        patches.repo_patch(tmp_path / "no-git")
+
+
+def test_write_patches_errors(tmp_path: Path, mocker: MockerFixture):
+    # Missing or broken repos are journalled as errors, the others are handled.
+    repos = [
+        tmp_path / "does-not-exist",
+        make_repo(tmp_path / "unreadable"),
+        make_repo(tmp_path / "good"),
+    ]
+    original_repo_patch = patches.repo_patch
+
+    def repo_patch(repo: Path, defaults: nens_toml.Defaults) -> str:
+        if repo.name == "unreadable":
+            raise PermissionError("Permission denied")
+        return original_repo_patch(repo, defaults)
+
+    mocker.patch.object(patches, "repo_patch", repo_patch)
+    output_dir = tmp_path / "patches"
+    run_journal = journal.Journal(output_dir / "journal.jsonl")
+    result = patches.write_patches(
+        repos, output_dir, workers=1, run_journal=run_journal
+    )
+    assert list(result) == [repos[2]]
+    assert not (output_dir / "does-not-exist.patch").exists()
+    statuses = [
+        json.loads(line)["status"]
+        for line in (output_dir / "journal.jsonl").read_text().splitlines()
+    ]
+    assert statuses == [journal.ERROR, journal.ERROR, journal.DONE]
+
+
+def test_worker_defaults(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # A worker process gets the defaults once, for all its repos.
+    monkeypatch.setattr(patches, "_worker_defaults", NO_DEFAULTS)
+    defaults = nens_toml.Defaults({"meta_workflow": {"python_version": "3.13"}})
+    patches._init_worker(defaults)
+    patch, error = patches._worker_repo_patch(make_repo(tmp_path / "repo"))
+    assert error is None
+    assert "3.13" in patch
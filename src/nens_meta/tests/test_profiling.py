@@ -0,0 +1,52 @@
+import pstats
+from pathlib import Path
+
+from nens_meta import nens_toml, profiling, update_project
+
+
+def test_label():
+    assert (
+        profiling._label(("~", 0, "<built-in method len>")) == "<built-in_method_len>"
+    )
+    assert profiling._label(("/a/b.py", 3, "c")) == "b.py:3(c)"
+
+
+def test_collapsed_stacks():
+    # main() spends 1s itself and calls helper() which takes 3s; recursive() calls
+    # itself.
+    main = ("main.py", 1, "main")
+    helper = ("main.py", 10, "helper")
+    recursive = ("main.py", 20, "recursive")
+    stats = {
+        main: (1, 1, 1.0, 4.0, {}),
+        helper: (1, 1, 3.0, 3.0, {main: (1, 1, 3.0, 3.0)}),
+        recursive: (2, 1, 0.5, 0.5, {recursive: (1, 1, 0.2, 0.2)}),
+    }
+    stacks = profiling.collapsed_stacks(stats, "phase")
+    assert stacks["phase;main.py:1(main)"] == 1_000_000
+    assert stacks["phase;main.py:1(main);main.py:10(helper)"] == 3_000_000
+
+
+def test_profiler(tmp_path: Path):
+    nens_toml.create_if_missing(tmp_path)
+    profiler = profiling.Profiler(tmp_path / "profile")
+    with profiler.phase("config"):
+        our_config = nens_toml.OurConfig(tmp_path)
+    update_project.plan_changes(tmp_path, our_config, profiler)
+    profiler.finish()
+    output = tmp_path / "profile"
+    assert (output / "00-config.pstats").exists()
+    assert (output / "01-editorconfig.pstats").exists()
+    pstats.Stats(str(output / "00-config.pstats"))  # Readable.
+    assert "editorconfig" in (output / "stacks.collapsed").read_text()
+    allocations = (output / "allocations.txt").read_text()
+    assert allocations
+    # Our own bookkeeping isn't part of the results.
+    assert "profiling.py" not in allocations
+    assert "tracemalloc.py" not in allocations
+
+
+def test_no_profiler():
+    with profiling.NO_PROFILER.phase("config"):
+        pass
+    profiling.NO_PROFILER.finish()
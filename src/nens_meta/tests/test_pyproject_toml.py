@@ -1,3 +1,4 @@
+import tomllib
 from pathlib import Path
 
 import pytest
@@ -68,3 +69,113 @@ def test_remove_old_sections(empty_python_config: pyproject_toml.PyprojectToml):
 
 def test_write_documentation():
     pyproject_toml.write_documentation()
+
+
+def test_remove_old_sections2(empty_python_config: pyproject_toml.PyprojectToml):
+    empty_python_config._config_file.write_text(
+        '[project]\nname = "reinout"\n\n[tool.isort]\nprofile = "black"\n'
+    )
+    config = pyproject_toml.PyprojectToml(empty_python_config._project, {})
+    config.remove_old_sections()
+    config.write()
+    assert config._config_file.read_text() == '[project]\nname = "reinout"\n'
+
+
+def test_remove_old_sections3(empty_python_config: pyproject_toml.PyprojectToml):
+    # An unusual layout is handled by tomlkit.
+    empty_python_config._config_file.write_text('[tool]\nisort = {profile = "x"}\n')
+    config = pyproject_toml.PyprojectToml(empty_python_config._project, {})
+    config.remove_old_sections()
+    config.write()
+    assert "isort" not in config._config_file.read_text()
+
+
+def test_suggest_only_touches_the_table(
+    empty_python_config: pyproject_toml.PyprojectToml,
+):
+    # Formatting elsewhere in the file is left alone.
+    original = '[project]\nname   =   "reinout"  # Odd formatting\n'
+    empty_python_config._config_file.write_text(original)
+    config = pyproject_toml.PyprojectToml(empty_python_config._project, {})
+    config.adjust_zestreleaser()
+    config.write()
+    assert config._config_file.read_text().startswith(original)
+
+
+def test_suggest_unsupported_layout(
+    empty_python_config: pyproject_toml.PyprojectToml,
+):
+    # Tables defined as dotted keys are handled by tomlkit.
+    empty_python_config._config_file.write_text("tool.zest-releaser.release = true\n")
+    config = pyproject_toml.PyprojectToml(empty_python_config._project, {})
+    config._suggest("tool.zest-releaser", "release", False, strongly=True)
+    config._suggest("tool.zest-releaser", "create-wheel", True)
+    config.write()
+    content = config._config_file.read_text()
+    assert "release = true" in content
+    assert "create-wheel = true" in content
+
+
+def test_suggest_escaped_multiline_string(
+    empty_python_config: pyproject_toml.PyprojectToml,
+):
+    # A fake table header inside a multi-line string with escapes is ignored.
+    original = 'd = """a\\"""\n[tool.ruff]\n"""\n'
+    empty_python_config._config_file.write_text(original)
+    config = pyproject_toml.PyprojectToml(empty_python_config._project, {})
+    config._suggest("tool.ruff", "target-version", "py312")
+    config.write()
+    content = config._config_file.read_text()
+    assert content.startswith(original)
+    assert tomllib.loads(content)["tool"]["ruff"]["target-version"] == "py312"
+
+
+UV_LOCK = """\
+version = 1
+
+[[package]]
+name = "Pytest"
+version = "8.3.0"
+dependencies = [
+    { name = "pluggy" },
+]
+
+[package.metadata]
+requires-dist = [
+    { name = "pytest-cov", specifier = ">=6" },
+]
+
+[[package]]
+name = "pytest_sugar"
+version = "1.1.1"
+"""
+
+
+def test_locked_versions():
+    lines = iter(UV_LOCK.splitlines(keepends=True))
+    found = pyproject_toml.locked_versions(lines, {"pytest"})
+    assert found == {"pytest": "8.3.0"}
+    # We stopped reading once pytest was found.
+    assert next(lines) == "dependencies = [\n"
+
+
+def test_check_uv_lock1(tmp_path: Path):
+    # No uv.lock, no problems.
+    assert pyproject_toml.check_uv_lock(tmp_path, ["pytest>=8.4.2"]) == []
+
+
+def test_check_uv_lock2(tmp_path: Path):
+    (tmp_path / "uv.lock").write_text(UV_LOCK)
+    problems = pyproject_toml.check_uv_lock(
+        tmp_path, pyproject_toml.DEV_PACKAGES + ["pytest-mock"]
+    )
+    assert problems == [
+        "pytest is locked at 8.3.0, we suggest at least 8.4.2",
+        "pytest-cov is not in uv.lock",
+        "pytest-mock is not in uv.lock",
+    ]
+
+
+def test_check_dev_packages_locked(empty_python_config: pyproject_toml.PyprojectToml):
+    (empty_python_config._project / "uv.lock").write_text(UV_LOCK)
+    empty_python_config.check_dev_packages_locked()
@@ -0,0 +1,97 @@
+import os
+from pathlib import Path
+
+import jinja2
+
+from nens_meta import render_cache
+
+
+def make_environment(source: str) -> jinja2.Environment:
+    return jinja2.Environment(loader=jinja2.DictLoader({"example.j2": source}))
+
+
+def trust(cache_file: Path):
+    # Pretend the cache was written a while after the generated files.
+    stat = cache_file.stat()
+    os.utime(cache_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10_000_000_000))
+
+
+def test_variables(tmp_path: Path):
+    cache = render_cache.RenderCache(tmp_path / "cache.json")
+    environment = make_environment(
+        "{{ a }}{% for x in b %}{{ x }}{% endfor %}{% if c %}{% endif %}"
+    )
+    assert cache.variables(environment, "example.j2") == {"a", "b", "c"}
+
+
+def test_variables_persisted(tmp_path: Path, mocker):
+    cache_file = tmp_path / "cache.json"
+    environment = make_environment("{{ a }}")
+    cache = render_cache.RenderCache(cache_file)
+    cache.variables(environment, "example.j2")
+    cache.save()
+    parse = mocker.spy(environment, "parse")
+    assert render_cache.RenderCache(cache_file).variables(
+        environment, "example.j2"
+    ) == {"a"}
+    assert not parse.called
+    # A changed template is parsed again.
+    changed = make_environment("{{ b }}")
+    assert render_cache.RenderCache(cache_file).variables(changed, "example.j2") == {
+        "b"
+    }
+
+
+def test_fingerprint(tmp_path: Path):
+    cache = render_cache.RenderCache(tmp_path / "cache.json")
+    cache.variables(make_environment("{{ a }}"), "example.j2")
+    assert cache.fingerprint("example.j2", {"a": 1}) == cache.fingerprint(
+        "example.j2", {"a": 1}
+    )
+    assert cache.fingerprint("example.j2", {"a": 1}) != cache.fingerprint(
+        "example.j2", {"a": 2}
+    )
+
+
+def test_is_fresh(tmp_path: Path):
+    cache_file = tmp_path / "cache.json"
+    target = tmp_path / "target.txt"
+    target.write_text("generated\n")
+    cache = render_cache.RenderCache(cache_file)
+    assert not cache.is_fresh(target, "inputs")
+    cache.remember(target, "inputs")
+    cache.save()
+    # Written in the same instant as the cache: racily clean, so not trusted.
+    target_mtime = target.stat().st_mtime_ns
+    os.utime(cache_file, ns=(target_mtime, target_mtime))
+    assert not render_cache.RenderCache(cache_file).is_fresh(target, "inputs")
+    trust(cache_file)
+    cache = render_cache.RenderCache(cache_file)
+    assert cache.is_fresh(target, "inputs")
+    assert not cache.is_fresh(target, "other inputs")
+    assert not render_cache.RenderCache(cache_file, reuse=False).is_fresh(
+        target, "inputs"
+    )
+    target.write_text("changed by hand\n")
+    assert not cache.is_fresh(target, "inputs")
+
+
+def test_save_missing_target(tmp_path: Path):
+    cache_file = tmp_path / "cache.json"
+    target = tmp_path / "target.txt"
+    target.write_text("generated\n")
+    cache = render_cache.RenderCache(cache_file)
+    cache.remember(target, "inputs")
+    cache.save()
+    target.unlink()
+    cache.remember(target, "inputs")
+    cache.save()
+    assert cache.files == {}
+
+
+def test_corrupt_or_old_cache(tmp_path: Path):
+    cache_file = tmp_path / "cache.json"
+    cache_file.write_text("{")
+    assert render_cache.RenderCache(cache_file).files == {}
+    cache_file.write_text('{"version": "0.1", "files": {"a": {}}}')
+    assert render_cache.RenderCache(cache_file).files == {}
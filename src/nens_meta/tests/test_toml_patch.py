@@ -0,0 +1,152 @@
+import pytest
+
+from nens_meta import toml_patch
+
+EXAMPLE = """\
+# Comment at the top
+[project]
+name = "example"
+dependencies = [
+  "[tool.fake]",
+  ["nested"],
+]
+description = '''
+[tool.ruff]
+'''
+readme = "README.md"  # [tool.ruff]
+
+# Comment for lint
+[tool.ruff.lint]
+select = ["E"]
+
+[ "tool" . 'isort' ]
+profile = "black"
+
+[tool.isort.sub]
+reinout = 1972
+
+[[tool.mypy.overrides]]
+module = "example"
+"""
+
+
+def test_scan_tables():
+    names = [span.name for span in toml_patch.scan_tables(EXAMPLE)]
+    assert names == [
+        (),
+        ("project",),
+        ("tool", "ruff", "lint"),
+        ("tool", "isort"),
+        ("tool", "isort", "sub"),
+        ("tool", "mypy", "overrides"),
+    ]
+
+
+def test_get_table():
+    assert toml_patch.get_table(EXAMPLE, "tool.ruff.lint") == {"select": ["E"]}
+    assert toml_patch.get_table(EXAMPLE, "tool.black") is None
+
+
+def test_setdefault1():
+    # A missing table is inserted in front of its sub-table, without taking the
+    # sub-table's comment along.
+    text, value = toml_patch.setdefault(EXAMPLE, "tool.ruff", "line-length", 88)
+    assert value == 88
+    assert "\n[tool.ruff]\nline-length = 88\n\n# Comment for lint\n" in text
+    # The rest is left alone.
+    assert text.replace("[tool.ruff]\nline-length = 88\n\n", "") == EXAMPLE
+
+
+def test_setdefault2():
+    # An existing value is left alone.
+    text, value = toml_patch.setdefault(EXAMPLE, "tool.ruff.lint", "select", ["F"])
+    assert text == EXAMPLE
+    assert value == ["E"]
+
+
+def test_setdefault3():
+    # A missing key is added at the end of the table.
+    text, _ = toml_patch.setdefault(EXAMPLE, "project", "version", "1.0")
+    assert 'readme = "README.md"  # [tool.ruff]\nversion = "1.0"\n' in text
+
+
+def test_setdefault4():
+    # A new table ends up after its relatives or at the end.
+    text, _ = toml_patch.setdefault(EXAMPLE, "tool.black", "x", 1)
+    assert "[tool.black]\nx = 1\n\n[[tool.mypy.overrides]]" not in text
+    assert text.endswith('module = "example"\n\n[tool.black]\nx = 1\n')
+    text, _ = toml_patch.setdefault("a = 1", "dependency-groups", "dev", ["pytest"])
+    assert text == 'a = 1\n\n[dependency-groups]\ndev = ["pytest"]\n'
+    text, _ = toml_patch.setdefault("", "zest-releaser", "release", False)
+    assert text == "[zest-releaser]\nrelease = false\n"
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "[tool]\nruff = {line-length = 88}\n",
+        "tool.ruff.line-length = 88\n",
+        "[[tool.ruff]]\nline-length = 88\n",
+    ],
+)
+def test_unsupported_layout(text: str):
+    with pytest.raises(toml_patch.UnsupportedLayoutError):
+        toml_patch.setdefault(text, "tool.ruff", "target-version", "py312")
+
+
+@pytest.mark.parametrize("key", ["", "tool.", "tool ruff", "'tool"])
+def test_unparseable_key(key: str):
+    with pytest.raises(toml_patch.UnsupportedLayoutError):
+        toml_patch._parse_key(key)
+
+
+def test_unparseable_header():
+    with pytest.raises(toml_patch.UnsupportedLayoutError):
+        toml_patch.scan_tables("[tool.ruff\n")
+
+
+def test_multiline_strings():
+    text = 'a = """\n[fake]\n""""\nb = "\\"[fake]"\n[real]\n'
+    names = [span.name for span in toml_patch.scan_tables(text)]
+    assert names == [(), ("real",)]
+
+
+def test_multiline_string_escapes():
+    # An escaped quote in a multi-line basic string doesn't end the string.
+    text = 'd = """a\\"""\n[tool.ruff]\n"""\n[real]\n'
+    names = [span.name for span in toml_patch.scan_tables(text)]
+    assert names == [(), ("real",)]
+    assert toml_patch.get_table(text, "tool.ruff") is None
+
+
+def test_parse_error():
+    # If our scan gets it wrong, tomlkit's parse error becomes an unsupported layout.
+    text = 'd = """a\n[tool.ruff]\n"""\n'
+    span = toml_patch.TableSpan(name=(), start=0, body_start=0, end=9)
+    with pytest.raises(toml_patch.UnsupportedLayoutError):
+        toml_patch._parse_body(text, span)
+
+
+def test_remove_table():
+    text = toml_patch.remove_table(EXAMPLE, "tool.isort")
+    assert "isort" not in text
+    assert "reinout" not in text
+    assert 'select = ["E"]\n\n[[tool.mypy.overrides]]' in text
+    assert toml_patch.remove_table(text, "tool.isort") == text
+    assert toml_patch.remove_table("[tool.isort]\na = 1\n", "tool.isort") == ""
+
+
+def test_crlf():
+    # Files with windows line endings get windows line endings for added lines.
+    text = '[project]\r\nname = "reinout"\r\n'
+    text, _ = toml_patch.setdefault(text, "tool.ruff", "target-version", "py312")
+    text, _ = toml_patch.setdefault(text, "project", "version", "1.0")
+    assert text == (
+        '[project]\r\nname = "reinout"\r\nversion = "1.0"\r\n'
+        '\r\n[tool.ruff]\r\ntarget-version = "py312"\r\n'
+    )
+    assert "\n" not in text.replace("\r\n", "")
+    text = toml_patch.remove_table(text, "tool.ruff")
+    assert text == '[project]\r\nname = "reinout"\r\nversion = "1.0"\r\n'
+    text = toml_patch.remove_table("[a]\r\nb = 1\r\n\r\n[c]\r\nd = 2\r\n", "a")
+    assert text == "[c]\r\nd = 2\r\n"
@@ -1,10 +1,11 @@
 """Tests for update_project.py"""
 
+import os
 from pathlib import Path
 
 import pytest
 
-from nens_meta import nens_toml, update_project
+from nens_meta import nens_toml, render_cache, update_project, utils
 
 
 def test_check_prerequisites1(tmp_path: Path):
@@ -13,6 +14,14 @@ def test_check_prerequisites1(tmp_path: Path):
         update_project.check_prerequisites(tmp_path)
 
 
+def test_project_problem(tmp_path: Path):
+    problem = update_project.project_problem(tmp_path / "nope")
+    assert problem == "Project dir doesn't exist"
+    assert update_project.project_problem(tmp_path) == "Project has no .git dir"
+    (tmp_path / ".git").mkdir()
+    assert update_project.project_problem(tmp_path) is None
+
+
 def test_check_prerequisites2(tmp_path: Path):
     (tmp_path / ".git").mkdir()
     with pytest.raises(SystemExit):
@@ -86,3 +95,124 @@ def test_requirements_yml(tmp_path):
     requirements_yml.write()
     content = (tmp_path / "requirements.yml").read_text()
     assert "Extra lines below" not in content
+
+
+def test_plan_changes1(tmp_path: Path):
+    # Planning the changes doesn't write anything yet.
+    (tmp_path / "ansible").mkdir()
+    (tmp_path / "setup.py").write_text("")
+    nens_toml.create_if_missing(tmp_path)
+    our_config = nens_toml.OurConfig(tmp_path)
+    changes = update_project.plan_changes(tmp_path, our_config)
+    targets = [change.target.name for change in changes.changes]
+    assert "pyproject.toml" in targets
+    assert "requirements.yml" in targets
+    assert not (tmp_path / ".editorconfig").exists()
+    changes.apply()
+    assert (tmp_path / ".github" / "workflows" / "nens-meta.yml").exists()
+
+
+def test_plan_changes2(tmp_path: Path):
+    # A wrong value in .nens.toml means nothing at all gets written.
+    nens_toml.nens_toml_file(tmp_path).write_text(
+        """
+    [meta_workflow]
+    run_pytest = "yes"
+    """
+    )
+    our_config = nens_toml.OurConfig(tmp_path)
+    with pytest.raises(ValueError):
+        update_project.plan_changes(tmp_path, our_config)
+    assert not (tmp_path / ".editorconfig").exists()
+
+
+def test_gitignore_duplicates(tmp_path: Path):
+    nens_toml.nens_toml_file(tmp_path).write_text(
+        """
+    [gitignore]
+    drop_duplicate_extra_lines = true
+    """
+    )
+    (tmp_path / ".gitignore").write_text(f"{utils.EXTRA_LINES_MARKER}.venv\n/data\n")
+    our_config = nens_toml.OurConfig(tmp_path)
+    update_project.Gitignore(tmp_path, our_config).write()
+    content = (tmp_path / ".gitignore").read_text()
+    assert content.endswith(f"{utils.EXTRA_LINES_MARKER}/data\n")
+
+
+def test_generated_targets():
+    targets = update_project.generated_targets()
+    assert "pyproject.toml" in targets
+    assert ".github/workflows/nens-meta.yml" in targets
+
+
+def test_hook_targets():
+    assert update_project.hook_targets(["README.md", "src/example.py"]) == set()
+    assert update_project.hook_targets([".gitignore", "uv.lock"]) == {
+        ".gitignore",
+        "pyproject.toml",
+    }
+    everything = update_project.hook_targets(["README.md", ".nens.toml"])
+    assert ".nens.toml" in everything
+    assert ".github/dependabot.yml" in everything
+
+
+def test_plan_changes_targets(tmp_path: Path):
+    # Only the requested targets are handled.
+    (tmp_path / "setup.py").write_text("")
+    nens_toml.create_if_missing(tmp_path)
+    our_config = nens_toml.OurConfig(tmp_path)
+    changes = update_project.plan_changes(tmp_path, our_config, targets={".gitignore"})
+    assert [change.target.name for change in changes.changes] == [".gitignore"]
+
+
+def test_plan_changes_render_cache(tmp_path: Path):
+    # Only files whose inputs changed are rendered again.
+    cache_file = tmp_path / "cache.json"
+    project = tmp_path / "project"
+    project.mkdir()
+    nens_toml.create_if_missing(project)
+
+    def rendered() -> list[str]:
+        our_config = nens_toml.OurConfig(project)
+        cache = render_cache.RenderCache(cache_file)
+        changes = update_project.plan_changes(project, our_config, cache=cache)
+        changes.apply()
+        result = sorted(target.name for target in cache.pending)
+        cache.save()
+        stat = cache_file.stat()
+        os.utime(cache_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**10))
+        return result
+
+    assert len(rendered()) == 5
+    assert rendered() == []
+    with nens_toml.nens_toml_file(project).open("a") as f:
+        f.write('\n[meta_workflow]\npython_version = "3.11"\n')
+    assert rendered() == ["nens-meta.yml"]
+
+
+def test_selected_targets():
+    assert update_project.selected_targets([], []) is None
+    assert update_project.selected_targets(["gitignore,meta_workflow"], []) == {
+        ".nens.toml",
+        ".gitignore",
+        ".github/workflows/nens-meta.yml",
+    }
+    skipped = update_project.selected_targets([], ["pyprojecttoml", "ansible"])
+    assert skipped is not None
+    assert "pyproject.toml" not in skipped
+    assert "requirements.yml" not in skipped
+    assert ".editorconfig" in skipped
+    with pytest.raises(ValueError):
+        update_project.selected_targets(["gitignroe"], [])
+
+
+def test_plan_changes_unselected(tmp_path: Path, mocker):
+    # Unselected files aren't even instantiated.
+    nens_toml.create_if_missing(tmp_path)
+    our_config = nens_toml.OurConfig(tmp_path)
+    init = mocker.spy(update_project.Editorconfig, "__init__")
+    targets = update_project.selected_targets(["gitignore"], [])
+    changes = update_project.plan_changes(tmp_path, our_config, targets=targets)
+    assert not init.called
+    assert [change.target.name for change in changes.changes] == [".gitignore"]
@@ -79,3 +79,42 @@ def test_uses_ansible1():
 def test_uses_ansible2(tmp_path: Path):
     (tmp_path / "ansible").mkdir()
     assert utils.uses_ansible(tmp_path)
+
+
+def test_extract_extra_lines3():
+    # A repeated marker doesn't lose the lines after it.
+    content = (
+        f"bla\n{utils.EXTRA_LINES_MARKER}reinout\n\n{utils.EXTRA_LINES_MARKER}van\n"
+    )
+    assert utils._extract_extra_lines(content) == "reinout\n\nvan\n"
+
+
+def test_dedupe_extra_lines1():
+    # Duplicates are reported, but kept by default.
+    extra_lines = "*.pyc\n# *.pyc\n\n/data\n"
+    result = utils._dedupe_extra_lines(Path(".gitignore"), "*.pyc\n\n", extra_lines)
+    assert result == extra_lines
+
+
+def test_dedupe_extra_lines2():
+    extra_lines = "*.pyc\n# *.pyc\n\n/data\n" + "".join(f"{i}\n" for i in range(6))
+    desired = "*.pyc\n" + "".join(f"{i}\n" for i in range(6))
+    result = utils._dedupe_extra_lines(
+        Path(".gitignore"), desired, extra_lines, drop_duplicates=True
+    )
+    assert result == "# *.pyc\n\n/data\n"
+
+
+def test_write_if_changed5(tmp_path: Path):
+    # Duplicate extra lines can be dropped.
+    f = tmp_path / "sample.txt"
+    f.write_text(f"old\n{utils.EXTRA_LINES_MARKER}test\n/data\n")
+    utils.write_if_changed(f, "test\n", check_duplicates=True, drop_duplicates=True)
+    assert f.read_text() == f"test\n\n{utils.EXTRA_LINES_MARKER}/data\n"
+
+
+def test_version_tuple():
+    assert utils.version_tuple("8.4.0") == (8, 4)
+    assert utils.version_tuple("8.4") == (8, 4)
+    assert utils.version_tuple("8.10rc1") == (8, 10)
+    assert utils.version_tuple("unknown") == ()
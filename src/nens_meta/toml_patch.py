@@ -0,0 +1,309 @@
+"""Purpose: edit toml text in place, only touching the parts that change
+
+Parsing a big pyproject.toml completely with tomlkit and writing it out again is
+slow and occasionally reformats content we didn't touch. For the handful of tables
+we manage, a lightweight lexical scan for the table headers is enough. Only the
+table we're interested in is parsed, changes are spliced into the original text.
+
+Tables defined in an unusual way (via dotted keys or inline tables, or as arrays of
+tables) raise `UnsupportedLayoutError`: the caller should then fall back to
+tomlkit.
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Any
+
+import tomlkit
+from tomlkit.exceptions import ParseError
+
+BARE_KEY = re.compile(r"[A-Za-z0-9_-]+")
+
+
+class UnsupportedLayoutError(Exception):
+    pass
+
+
+@dataclass
+class TableSpan:
+    """Location of one table in the text
+
+    `name` is empty for the root table (the part before the first header). The span
+    runs from the start of the header line up to the start of the next header.
+    """
+
+    name: tuple[str, ...]
+    start: int
+    body_start: int
+    end: int
+    is_array: bool = False
+
+
+def _parse_key(key: str) -> tuple[str, ...]:
+    """Return the parts of a (dotted, possibly quoted) key"""
+    parts = []
+    rest = key.strip()
+    while True:
+        if rest[:1] in ("'", '"'):
+            closing = rest.find(rest[0], 1)
+            if closing == -1:
+                raise UnsupportedLayoutError(f"Cannot parse key {key}")
+            parts.append(rest[1:closing])
+            rest = rest[closing + 1 :].lstrip()
+        else:
+            match = BARE_KEY.match(rest)
+            if match is None:
+                raise UnsupportedLayoutError(f"Cannot parse key {key}")
+            parts.append(match.group())
+            rest = rest[match.end() :].lstrip()
+        if not rest:
+            return tuple(parts)
+        if not rest.startswith("."):
+            raise UnsupportedLayoutError(f"Cannot parse key {key}")
+        rest = rest[1:].lstrip()
+
+
+def _format_key(name: tuple[str, ...]) -> str:
+    return ".".join(tomlkit.key(part).as_string() for part in name)
+
+
+def _skip_string(line: str, position: int) -> int:
+    """Return the position after the single-line string starting at position"""
+    quote = line[position]
+    position += 1
+    while position < len(line):
+        if quote == '"' and line[position] == "\\":
+            position += 2
+            continue
+        if line[position] == quote:
+            return position + 1
+        position += 1
+    return position
+
+
+class _Scanner:
+    """Track multi-line strings and arrays/inline tables across lines"""
+
+    def __init__(self):
+        self.multiline_quote: str | None = None
+        self.depth = 0
+
+    @property
+    def at_top_level(self) -> bool:
+        return self.multiline_quote is None and self.depth == 0
+
+    def _skip_multiline(self, line: str, position: int) -> int:
+        """Return the position after the multi-line string's end (or the line's)"""
+        quote = self.multiline_quote
+        assert quote is not None
+        while position < len(line):
+            if quote == '"""' and line[position] == "\\":
+                # Escaped character (like \"), no end of the string.
+                position += 2
+            elif line.startswith(quote, position):
+                # A multi-line string can end with up to two extra quotes.
+                position += 3
+                while line[position : position + 1] == quote[0]:
+                    position += 1
+                self.multiline_quote = None
+                return position
+            else:
+                position += 1
+        return position
+
+    def feed(self, line: str):
+        position = 0
+        while position < len(line):
+            if self.multiline_quote:
+                position = self._skip_multiline(line, position)
+                continue
+            character = line[position]
+            if character == "#":
+                return
+            if line.startswith('"""', position) or line.startswith("'''", position):
+                self.multiline_quote = line[position : position + 3]
+                position += 3
+            elif character in "\"'":
+                position = _skip_string(line, position)
+            else:
+                if character in "[{":
+                    self.depth += 1
+                elif character in "]}":
+                    self.depth -= 1
+                position += 1
+
+
+def _parse_header(line: str) -> tuple[tuple[str, ...], bool] | None:
+    """Return the table name and whether it's an array of tables, if a header"""
+    stripped = line.strip()
+    if not stripped.startswith("["):
+        return None
+    is_array = stripped.startswith("[[")
+    opening = 2 if is_array else 1
+    closing_bracket = "]]" if is_array else "]"
+    # Find the closing bracket, skipping quoted keys.
+    position = opening
+    while position < len(stripped):
+        if stripped[position] in "\"'":
+            position = _skip_string(stripped, position)
+        elif stripped.startswith(closing_bracket, position):
+            break
+        else:
+            position += 1
+    else:
+        raise UnsupportedLayoutError(f"Cannot parse table header {stripped}")
+    return _parse_key(stripped[opening:position]), is_array
+
+
+def scan_tables(text: str) -> list[TableSpan]:
+    """Return the spans of all tables, the root table first"""
+    spans = [TableSpan(name=(), start=0, body_start=0, end=len(text))]
+    scanner = _Scanner()
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        header = _parse_header(line) if scanner.at_top_level else None
+        if header is None:
+            scanner.feed(line)
+        else:
+            spans[-1].end = offset
+            name, is_array = header
+            spans.append(
+                TableSpan(
+                    name=name,
+                    start=offset,
+                    body_start=offset + len(line),
+                    end=len(text),
+                    is_array=is_array,
+                )
+            )
+        offset += len(line)
+    return spans
+
+
+def _newline(text: str) -> str:
+    """Return the line ending the text uses, so we add the same ones"""
+    return "\r\n" if "\r\n" in text else "\n"
+
+
+def _content_end(text: str, span: TableSpan) -> int:
+    """Return the position after the last non-blank, non-comment line of the span"""
+    body = text[span.body_start : span.end]
+    content_end = span.body_start
+    offset = span.body_start
+    for line in body.splitlines(keepends=True):
+        offset += len(line)
+        stripped = line.strip()
+        if stripped and not stripped.startswith("#"):
+            content_end = offset
+    return content_end
+
+
+def _parse_body(text: str, span: TableSpan) -> dict:
+    try:
+        return tomlkit.parse(text[span.body_start : span.end]).unwrap()
+    except ParseError as e:
+        # Probably something our scan didn't understand.
+        raise UnsupportedLayoutError(f"Cannot parse [{_format_key(span.name)}]: {e}")
+
+
+def _find(text: str, spans: list[TableSpan], name: tuple[str, ...]) -> TableSpan | None:
+    """Return the span of the table, checking we can handle its layout"""
+    for length in range(len(name)):
+        # Tables can also be defined as dotted keys or inline tables in a parent.
+        for parent in spans:
+            if parent.name == name[:length] and not parent.is_array:
+                if name[length] in _parse_body(text, parent):
+                    raise UnsupportedLayoutError(
+                        f"[{_format_key(name)}] is defined inside "
+                        f"[{_format_key(parent.name)}]"
+                    )
+    found = [span for span in spans if span.name == name]
+    if any(span.is_array for span in found):
+        raise UnsupportedLayoutError(f"[{_format_key(name)}] is an array of tables")
+    return found[0] if found else None
+
+
+def _insert_table(text: str, spans: list[TableSpan], name: tuple[str, ...]) -> str:
+    """Return text with an empty table added in a sensible location
+
+    That's in front of its first sub-table or otherwise after the last table that
+    shares the longest possible prefix (so [tool.ruff] ends up between the other
+    [tool.*] tables). Comments in front of the next table stay with that table.
+    """
+    position = len(text)
+    subtables = [
+        index for index, span in enumerate(spans) if span.name[: len(name)] == name
+    ]
+    if subtables:
+        position = _content_end(text, spans[subtables[0] - 1])
+    else:
+        for length in range(len(name) - 1, 0, -1):
+            relatives = [span for span in spans if span.name[:length] == name[:length]]
+            if relatives:
+                position = _content_end(text, relatives[-1])
+                break
+    newline = _newline(text)
+    before, after = text[:position], text[position:]
+    if before and not before.endswith("\n"):
+        before += newline
+    if before.strip():
+        before += newline
+    if after and not after.startswith(newline):
+        after = newline + after
+    return before + f"[{_format_key(name)}]{newline}" + after
+
+
+def get_table(text: str, name: str) -> dict | None:
+    """Return the (parsed) contents of the table, if it exists"""
+    table_name = _parse_key(name)
+    span = _find(text, scan_tables(text), table_name)
+    if span is None:
+        return None
+    return _parse_body(text, span)
+
+
+def setdefault(text: str, name: str, key: str, value: Any) -> tuple[str, Any]:
+    """Add key to the table if it is missing, creating the table if needed
+
+    Return the new text and the value the key now has.
+    """
+    table_name = _parse_key(name)
+    spans = scan_tables(text)
+    span = _find(text, spans, table_name)
+    if span is None:
+        text = _insert_table(text, spans, table_name)
+        spans = scan_tables(text)
+        span = _find(text, spans, table_name)
+        assert span is not None
+    current = _parse_body(text, span)
+    if key in current:
+        return text, current[key]
+
+    position = _content_end(text, span)
+    newline = _newline(text)
+    line = f"{_format_key((key,))} = {tomlkit.item(value).as_string()}{newline}"
+    before = text[:position]
+    if before and not before.endswith("\n"):
+        before += newline
+    return before + line + text[position:], value
+
+
+def remove_table(text: str, name: str) -> str:
+    """Return text without the table and its sub-tables"""
+    table_name = _parse_key(name)
+    spans = scan_tables(text)
+    _find(text, spans, table_name)  # Check the layout.
+    newline = _newline(text)
+    for span in reversed(spans):
+        if span.name[: len(table_name)] != table_name:
+            continue
+        before = text[: span.start]
+        after = text[_content_end(text, span) :]
+        if not after.strip():
+            # Last table in the file: don't leave empty lines at the end.
+            text = before.rstrip("\r\n") + newline if before.strip() else ""
+            continue
+        if not before.strip() or before.endswith(newline * 2):
+            after = after.lstrip("\r\n")
+        text = before + after
+    return text
@@ -1,5 +1,8 @@
+import json
 import logging
 import sys
+import time
+from dataclasses import dataclass
 from functools import cached_property
 from pathlib import Path
 from typing import Annotated
@@ -7,7 +10,20 @@ from typing import Annotated
 import jinja2
 import typer
 
-from nens_meta import nens_toml, pyproject_toml, utils
+from nens_meta import (
+    benchmarks,
+    changeset,
+    filesystem,
+    fleet_index,
+    journal,
+    mirrors,
+    nens_toml,
+    patches,
+    profiling,
+    pyproject_toml,
+    render_cache,
+    utils,
+)
 
 TEMPLATES_BASEDIR = Path(__file__).parent / "templates"
 
@@ -30,11 +46,16 @@ class TemplatedFile:
     target_name: str  # Note: can be "subdir/some-file.txt"
     section_name: str
     only_create_dont_change: bool = False
+    check_duplicate_extra_lines: bool = False  # Only for line-based files
 
     def __init__(self, project_dir: Path, our_config: nens_toml.OurConfig) -> None:
         self.project_dir = project_dir
         self.our_config = our_config
 
+    @property
+    def fs(self) -> filesystem.Filesystem:
+        return self.our_config.fs
+
     @property
     def target(self) -> Path:
         return self.project_dir / self.target_name
@@ -91,30 +112,38 @@ class TemplatedFile:
         )
         return utils.strip_whitespace(rendered)
 
-    def create_dirs_if_needed(self):
-        *directories, _ = self.target_name.split("/")
-        if directories:
-            target_dir = self.project_dir / "/".join(directories)
-            if target_dir.exists():
-                return
-            target_dir.mkdir(parents=True)
-            logger.info(f"Created directory {target_dir}")
+    def inputs(self, cache: render_cache.RenderCache) -> str:
+        """Return a fingerprint of everything the generated file depends on"""
+        variables = cache.variables(self.environment, self.template_name)
+        # Not used in the template, but when writing the file.
+        variables.add("drop_duplicate_extra_lines")
+        values = {key: self.options.get(key) for key in sorted(variables)}
+        return cache.fingerprint(self.template_name, values)
 
-    def write(self):
-        """Copy the source template to the target, doing the jinja2 stuff"""
-        self.create_dirs_if_needed()
+    def stage(self, changes: changeset.ChangeSet):
+        """Add the rendered template to the change set (if needed)"""
         handle_extra_lines = True  # default
         if self.only_create_dont_change:
             handle_extra_lines = (
                 False  # No need for this if we're not updating the file.
             )
-            if self.target.exists():
+            if self.fs.exists(self.target):
                 logger.debug(f"{self.target} already exists, skipping")
                 return
-        utils.write_if_changed(
-            self.target, self.content, handle_extra_lines=handle_extra_lines
+        changes.add(
+            self.target,
+            self.content,
+            handle_extra_lines=handle_extra_lines,
+            check_duplicates=self.check_duplicate_extra_lines,
+            drop_duplicates=self.our_options.get("drop_duplicate_extra_lines", False),
         )
 
+    def write(self):
+        """Copy the source template to the target, doing the jinja2 stuff"""
+        changes = changeset.ChangeSet(self.fs)
+        self.stage(changes)
+        changes.apply()
+
 
 class Editorconfig(TemplatedFile):
     """Wrapper around a project's editorconfig"""
@@ -130,6 +159,7 @@ class Gitignore(TemplatedFile):
     template_name = "gitignore.j2"
     target_name = ".gitignore"
     section_name = "gitignore"
+    check_duplicate_extra_lines = True
 
 
 class Precommitconfig(TemplatedFile):
@@ -165,77 +195,465 @@ class RequirementsYml(TemplatedFile):
     only_create_dont_change = True
 
 
-def check_prerequisites(project_dir: Path):
-    """Check prerequisites, exit if not met"""
-    if not (project_dir / ".git").exists():
+@dataclass
+class GeneratedFile:
+    """Registry entry for a file we generate
+
+    The file is only generated if the `condition` meta option (if any) is true.
+    """
+
+    name: str  # Same as its section in .nens.toml
+    target_name: str
+    templated_file_class: type[TemplatedFile] | None = None  # None: pyproject.toml
+    condition: str | None = None
+
+
+GENERATED_FILES: list[GeneratedFile] = [
+    GeneratedFile("pyprojecttoml", pyproject_toml.FILENAME, condition="uses_python"),
+    GeneratedFile("editorconfig", Editorconfig.target_name, Editorconfig),
+    GeneratedFile("gitignore", Gitignore.target_name, Gitignore),
+    GeneratedFile("pre-commit-config", Precommitconfig.target_name, Precommitconfig),
+    GeneratedFile("dependabot", DependabotYml.target_name, DependabotYml),
+    GeneratedFile("meta_workflow", MetaWorkflowYml.target_name, MetaWorkflowYml),
+    GeneratedFile(
+        "ansible",
+        RequirementsYml.target_name,
+        RequirementsYml,
+        condition="uses_ansible",
+    ),
+]
+
+
+def selected_targets(only: list[str], skip: list[str]) -> set[str] | None:
+    """Return the targets to handle for --only/--skip, None means everything
+
+    Names are those of the `GENERATED_FILES`, comma-separated lists are allowed.
+    .nens.toml itself is always handled.
+    """
+    names = {generated_file.name for generated_file in GENERATED_FILES}
+    only_names = {name.strip() for value in only for name in value.split(",")}
+    skip_names = {name.strip() for value in skip for name in value.split(",")}
+    for name in only_names | skip_names:
+        if name not in names:
+            raise ValueError(
+                f"Unknown generated file {name}, pick from {', '.join(sorted(names))}"
+            )
+    if not only_names and not skip_names:
+        return None
+    selected = (only_names or names) - skip_names
+    return {nens_toml.META_FILENAME} | {
+        generated_file.target_name
+        for generated_file in GENERATED_FILES
+        if generated_file.name in selected
+    }
+
+
+def project_problem(
+    project_dir: Path, fs: filesystem.Filesystem = filesystem.DISK
+) -> str | None:
+    """Return why the dir isn't a project we can handle, None if it is"""
+    if not fs.is_dir(project_dir):
+        return "Project dir doesn't exist"
+    if not fs.exists(project_dir / ".git"):
         if project_dir.absolute().name.startswith("{{ cookiecutter"):
             logger.info("Cookiecutter project dir detected")
         else:
             # No git and not the cookiecutter special case.
-            logger.error("Project has no .git dir")
-            sys.exit(1)
-    if not nens_toml.nens_toml_file(project_dir).exists():
-        nens_toml.create_if_missing(project_dir)
+            return "Project has no .git dir"
+    return None
+
+
+def check_prerequisites(project_dir: Path, fs: filesystem.Filesystem = filesystem.DISK):
+    """Check prerequisites, exit if not met"""
+    problem = project_problem(project_dir, fs)
+    if problem:
+        logger.error(problem)
+        sys.exit(1)
+    if not fs.exists(nens_toml.nens_toml_file(project_dir)):
+        nens_toml.create_if_missing(project_dir, fs)
         logger.warning("No .nens.toml found, created one. Re-run after checking.")
         sys.exit(1)
 
 
-def do_some_python_checks(project_dir: Path):
+def do_some_python_checks(
+    project_dir: Path, fs: filesystem.Filesystem = filesystem.DISK
+):
     """Run some checks to help identify issues and things you still need to do"""
-    for file_to_check in project_dir.glob("*.outdated"):
+    for file_to_check in fs.glob(project_dir, "*.outdated"):
         logger.warning(
             f"Check the old {file_to_check}: move settings to pyproject.toml, perhaps?"
         )
     website = "https://nens-meta.readthedocs.io"
-    readme = Path("README.md")
-    if readme.exists():
-        if website not in readme.read_text():
+    readme = project_dir / "README.md"
+    if fs.exists(readme):
+        if website not in fs.read_text(readme):
             logger.warning(
                 f"{website} is not mentioned in the readme as an instruction"
             )
 
 
+def stage_pyproject(
+    project_dir: Path, our_config: nens_toml.OurConfig, changes: changeset.ChangeSet
+):
+    """Add the changes to pyproject.toml to the change set"""
+    options_for_project_config = {}
+    options_for_project_config.update(our_config.section_options("meta"))
+    options_for_project_config.update(our_config.section_options("pyprojecttoml"))
+    project_config = pyproject_toml.PyprojectToml(
+        project_dir, options_for_project_config, our_config.fs
+    )
+    project_config.update()
+    project_config.stage(changes)
+
+
+def plan_changes(
+    project_dir: Path,
+    our_config: nens_toml.OurConfig,
+    profiler: profiling.Profiler | profiling.NoProfiler = profiling.NO_PROFILER,
+    targets: set[str] | None = None,
+    cache: render_cache.RenderCache | None = None,
+) -> changeset.ChangeSet:
+    """Return all changes the project needs, without writing anything yet
+
+    Everything is rendered in memory first, so an error (like a wrongly-typed value
+    in .nens.toml) doesn't leave the project half-updated. Pass `targets` to only
+    handle those files (like ".nens.toml" or ".gitignore"). With a render cache,
+    generated files whose inputs didn't change since the last run are skipped. Call
+    `cache.save()` after applying the changes.
+    """
+
+    def wanted(target: str) -> bool:
+        return targets is None or target in targets
+
+    changes = changeset.ChangeSet(our_config.fs)
+    with profiler.phase("config"):
+        if wanted(nens_toml.META_FILENAME):
+            our_config.stage(changes)
+        meta_options = our_config.section_options("meta")
+
+    for generated_file in GENERATED_FILES:
+        # Skipped files don't even get instantiated.
+        if not wanted(generated_file.target_name):
+            continue
+        if generated_file.condition and not meta_options[generated_file.condition]:
+            continue
+        with profiler.phase(generated_file.target_name):
+            if generated_file.templated_file_class is None:
+                stage_pyproject(project_dir, our_config, changes)
+                continue
+            templated_file = generated_file.templated_file_class(
+                project_dir, our_config
+            )
+            if cache is None:
+                templated_file.stage(changes)
+                continue
+            inputs = templated_file.inputs(cache)
+            if cache.is_fresh(templated_file.target, inputs):
+                logger.debug(f"{templated_file.target} is up to date, not rendering")
+                continue
+            templated_file.stage(changes)
+            cache.remember(templated_file.target, inputs)
+    return changes
+
+
+app = typer.Typer(help="Keep the basic setup of N&S projects up to date")
+
+
+@app.callback(invoke_without_command=True)
 def update_project(
+    ctx: typer.Context,
     verbose: Annotated[bool, typer.Option(help="Verbose logging")] = False,
+    defaults: Annotated[
+        Path | None,
+        typer.Option(
+            help="Shared defaults file, layered beneath .nens.toml",
+            envvar=nens_toml.DEFAULTS_ENVVAR,
+        ),
+    ] = None,
+    index_db: Annotated[
+        Path | None,
+        typer.Option(
+            help="Record the duration of the run in this fleet index",
+            envvar=fleet_index.DB_ENVVAR,
+        ),
+    ] = None,
+    profile: Annotated[
+        Path | None,
+        typer.Option(help="Write profiling results per phase to this directory"),
+    ] = None,
+    cache_file: Annotated[
+        Path,
+        typer.Option(
+            "--render-cache",
+            help="Remember inputs of generated files, to skip unchanged ones",
+            envvar=render_cache.CACHE_ENVVAR,
+        ),
+    ] = render_cache.DEFAULT_FILE,
+    full: Annotated[
+        bool, typer.Option(help="Re-render all generated files, ignore the cache")
+    ] = False,
+    only: Annotated[
+        list[str] | None,
+        typer.Option(help="Only these generated files, like gitignore,meta_workflow"),
+    ] = None,
+    skip: Annotated[
+        list[str] | None, typer.Option(help="Skip these generated files")
+    ] = None,
 ):  # pragma: no cover
-    project_dir = Path(".")
+    """Update the project in the current directory (if no command is given)"""
     log_level = logging.DEBUG if verbose else logging.INFO
     logging.basicConfig(level=log_level, format="%(levelname)-7s: %(message)s")
+    shared_defaults = (
+        nens_toml.load_defaults(defaults) if defaults else nens_toml.NO_DEFAULTS
+    )
+    ctx.obj = shared_defaults
+    if ctx.invoked_subcommand is not None:
+        return
+
+    try:
+        targets = selected_targets(only or [], skip or [])
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+    start = time.monotonic()
+    profiler = profiling.Profiler(profile) if profile else profiling.NO_PROFILER
+    project_dir = Path(".")
     check_prerequisites(project_dir)
-    our_config = nens_toml.OurConfig(project_dir)
-    our_config.write()
-
-    if our_config.section_options("meta")["uses_python"]:
-        if not pyproject_toml.pyproject_toml_file(project_dir).exists():
-            pyproject_toml.create_if_missing(project_dir)
-        options_for_project_config = {}
-        options_for_project_config.update(our_config.section_options("meta"))
-        options_for_project_config.update(our_config.section_options("pyprojecttoml"))
-        project_config = pyproject_toml.PyprojectToml(
-            project_dir, options_for_project_config
-        )
-        project_config.update()
-        project_config.write()
-
-    # Grab editorconfig table and pass it along. Or rather the whole thing?
-    editorconfig = Editorconfig(project_dir, our_config)
-    editorconfig.write()
-    gitignore = Gitignore(project_dir, our_config)
-    gitignore.write()
-    precommitconfig = Precommitconfig(project_dir, our_config)
-    precommitconfig.write()
-    dependabot_yml = DependabotYml(project_dir, our_config)
-    dependabot_yml.write()
-    meta_workflow_yml = MetaWorkflowYml(project_dir, our_config)
-    meta_workflow_yml.write()
-
-    if our_config.section_options("meta")["uses_ansible"]:
-        requirements_yml = RequirementsYml(project_dir, our_config)
-        requirements_yml.write()
+    with profiler.phase("config"):
+        our_config = nens_toml.OurConfig(project_dir, defaults=shared_defaults)
+    cache = render_cache.RenderCache(cache_file, reuse=not full)
+    changes = plan_changes(
+        project_dir, our_config, profiler, targets=targets, cache=cache
+    )
+    with profiler.phase("apply"):
+        changes.apply()
+    cache.save()
+    profiler.finish()
 
     if our_config.section_options("meta")["uses_python"]:
         do_some_python_checks(project_dir)
+    if index_db:
+        index = fleet_index.FleetIndex(index_db)
+        index.update(project_dir, generated_targets(), shared_defaults)
+        index.record_run(project_dir, time.monotonic() - start)
+        index.close()
+
+
+@app.command()
+def index(
+    ctx: typer.Context,
+    repos: Annotated[
+        list[Path] | None, typer.Argument(help="Repo directories to (re-)index")
+    ] = None,
+    db: Annotated[
+        Path, typer.Option(help="Sqlite database", envvar=fleet_index.DB_ENVVAR)
+    ] = fleet_index.DEFAULT_DB,
+    where: Annotated[
+        list[str] | None,
+        typer.Option(
+            help="List the repos matching key=value, like python_version=3.11"
+        ),
+    ] = None,
+    stalest: Annotated[
+        int, typer.Option(help="List the N repos with the oldest meta_version")
+    ] = 0,
+):  # pragma: no cover
+    """Update the fleet index, only re-reading repos that changed"""
+    fleet = fleet_index.FleetIndex(db)
+    changed, errors = fleet.update_many(repos or [], generated_targets(), ctx.obj)
+    if repos:
+        logger.info(
+            f"Re-indexed {changed} of {len(repos)} repos, {len(errors)} with errors"
+        )
+    if where or stalest:
+        try:
+            conditions = dict(
+                fleet_index.parse_condition(condition) for condition in where or []
+            )
+            rows = fleet.repos(**conditions)
+        except ValueError as e:
+            raise typer.BadParameter(str(e)) from e
+        for row in rows[:stalest] if stalest else rows:
+            typer.echo(f"{row['meta_version']}\t{row['python_version']}\t{row['path']}")
+    fleet.close()
+    if errors:
+        raise typer.Exit(1)
+
+
+@app.command()
+def hook(
+    ctx: typer.Context,
+    filenames: Annotated[
+        list[str] | None, typer.Argument(help="Changed files (passed by pre-commit)")
+    ] = None,
+):  # pragma: no cover
+    """Pre-commit hook: only update the generated files affected by the changes"""
+    targets = hook_targets(filenames or [])
+    if not targets:
+        logger.debug("No changes relevant for nens-meta")
+        return
+    project_dir = Path(".")
+    if not nens_toml.nens_toml_file(project_dir).exists():
+        logger.error(
+            f"No {nens_toml.META_FILENAME} found, run nens-meta once to create it"
+        )
+        raise typer.Exit(1)
+    our_config = nens_toml.OurConfig(project_dir, defaults=ctx.obj)
+    changes = plan_changes(project_dir, our_config, targets=targets)
+    if changes:
+        changes.apply()
+        # Pre-commit's convention: fail if we changed something.
+        raise typer.Exit(1)
+
+
+@app.command("patches")
+def write_patches(
+    ctx: typer.Context,
+    repos: Annotated[list[Path], typer.Argument(help="Repo directories")],
+    output: Annotated[
+        Path, typer.Option(help="Directory to write the patches to")
+    ] = Path("nens-meta-patches"),
+    workers: Annotated[
+        int | None, typer.Option(help="Number of processes (default: one per CPU)")
+    ] = None,
+    journal_file: Annotated[
+        Path | None,
+        typer.Option("--journal", help="Journal file (default: in the output dir)"),
+    ] = None,
+    resume: Annotated[
+        bool, typer.Option(help="Skip repos the journal lists as done")
+    ] = False,
+    shard: Annotated[
+        str | None, typer.Option(help="Only handle part i of n of the repos (i/n)")
+    ] = None,
+):  # pragma: no cover
+    """Write the changes per repo as patches, without touching the checkouts"""
+    repos = _sharded(repos, shard)
+    run_journal = journal.Journal(journal_file or output / "journal.jsonl")
+    written = patches.write_patches(
+        repos, output, ctx.obj, workers, run_journal, resume
+    )
+    logger.info(f"Wrote {len(written)} patches for {len(repos)} repos to {output}")
+
+
+def _sharded(repos: list[Path], shard: str | None) -> list[Path]:  # pragma: no cover
+    try:
+        return journal.in_shard(repos, shard)
+    except ValueError as e:
+        raise typer.BadParameter(str(e)) from e
+
+
+@app.command()
+def audit(
+    ctx: typer.Context,
+    mirror_dirs: Annotated[list[Path], typer.Argument(help="Bare mirrors of repos")],
+    ref: Annotated[str, typer.Option(help="Branch/tag/commit to audit")] = "HEAD",
+    journal_file: Annotated[
+        Path | None, typer.Option("--journal", help="Record the outcomes here")
+    ] = None,
+    resume: Annotated[
+        bool, typer.Option(help="Skip mirrors the journal lists as done")
+    ] = False,
+    shard: Annotated[
+        str | None, typer.Option(help="Only handle part i of n of the mirrors (i/n)")
+    ] = None,
+):  # pragma: no cover
+    """Report generated files that drifted, reading straight from git mirrors"""
+    mirror_dirs = _sharded(mirror_dirs, shard)
+    run_journal = journal.Journal(journal_file) if journal_file else None
+    problems = 0
+    for mirror in mirror_dirs:
+        result = mirrors.audit_mirror(mirror, ref, ctx.obj, run_journal, resume)
+        if result.error:
+            typer.echo(f"{mirror}\terror: {result.error}")
+        for drifted in result.drifted:
+            typer.echo(f"{mirror}\t{drifted}")
+        problems += bool(result.error or result.drifted)
+    logger.info(f"{problems} of {len(mirror_dirs)} mirrors need attention")
+    if problems:
+        raise typer.Exit(1)
+
+
+@app.command()
+def benchmark(
+    names: Annotated[
+        list[str] | None, typer.Argument(help="Benchmarks to run (default: all)")
+    ] = None,
+    baseline: Annotated[
+        Path, typer.Option(help="Baseline JSON file")
+    ] = benchmarks.DEFAULT_BASELINE,
+    threshold: Annotated[
+        float, typer.Option(help="Allowed slowdown, 0.25 means 25%")
+    ] = benchmarks.DEFAULT_THRESHOLD,
+    update: Annotated[
+        bool, typer.Option(help="Store the results as the new baseline")
+    ] = False,
+):  # pragma: no cover
+    """Run microbenchmarks of the helpers and compare them with the baseline"""
+    if baseline == benchmarks.DEFAULT_BASELINE and not benchmarks.in_source_checkout():
+        # Don't write a stray benchmarks.json somewhere in an installed nens-meta.
+        raise typer.BadParameter(
+            "Run the benchmarks from a nens-meta checkout or pass --baseline"
+        )
+    unknown = set(names or []) - set(benchmarks.all_benchmarks())
+    if unknown:
+        raise typer.BadParameter(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+    results = benchmarks.run(names)
+    stored = benchmarks.load_baseline(baseline)
+    if update:
+        benchmarks.save_baseline(baseline, {**stored, **results})
+        logger.info(f"Updated {baseline}")
+        return
+    regressions = benchmarks.compare(results, stored, threshold)
+    for regression in regressions:
+        logger.error(f"Regression: {regression}")
+    if regressions:
+        raise typer.Exit(1)
+
+
+@app.command()
+def validate(
+    files: Annotated[list[Path], typer.Argument(help=".nens.toml or defaults files")],
+):  # pragma: no cover
+    """Only validate config files: no detection, no rendering"""
+    invalid = 0
+    for config_file in files:
+        errors, warnings = nens_toml.validate_file(config_file)
+        for warning in warnings:
+            logger.warning(f"{config_file}: {warning}")
+        for error in errors:
+            typer.echo(f"{config_file}: {error}")
+        invalid += bool(errors)
+    logger.info(f"{invalid} of {len(files)} files have errors")
+    if invalid:
+        raise typer.Exit(1)
+
+
+@app.command()
+def schema():  # pragma: no cover
+    """Print the JSON Schema of .nens.toml (for editors)"""
+    typer.echo(json.dumps(nens_toml.json_schema(), indent=2))
+
+
+def hook_targets(filenames: list[str]) -> set[str]:
+    """Return the files to re-generate/check when these files changed"""
+    generated = generated_targets()
+    targets = set()
+    for filename in filenames:
+        name = Path(filename).as_posix()
+        if name == nens_toml.META_FILENAME:
+            # Everything depends on our config file.
+            return {nens_toml.META_FILENAME, *generated}
+        if name == pyproject_toml.UV_LOCK_FILENAME:
+            targets.add(pyproject_toml.FILENAME)
+        elif name in generated:
+            targets.add(name)
+    return targets
+
+
+def generated_targets() -> list[str]:
+    """Return the files we generate, relative to the project"""
+    return [generated_file.target_name for generated_file in GENERATED_FILES]
 
 
 def main():  # pragma: no cover
-    typer.run(update_project)
+    app()
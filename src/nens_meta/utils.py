@@ -2,6 +2,8 @@ import logging
 import re
 from pathlib import Path
 
+from nens_meta import filesystem
+
 logger = logging.getLogger(__name__)
 
 EXTRA_LINES_MARKER = "### Extra lines below are preserved ###\n"
@@ -24,29 +26,81 @@ def strip_whitespace(content: str) -> str:
 
 
 def _extract_extra_lines(content: str) -> str:
-    """Return content after the extra lines marker"""
-    parts = content.split(EXTRA_LINES_MARKER)
-    if len(parts) > 1:
-        return parts[1]
-    else:
+    """Return content after the extra lines marker
+
+    A repeated marker is removed, the lines after it are kept.
+    """
+    position = content.find(EXTRA_LINES_MARKER)
+    if position == -1:
         return ""
+    extra_lines = content[position + len(EXTRA_LINES_MARKER) :]
+    return extra_lines.replace(EXTRA_LINES_MARKER, "")
 
 
-def write_if_changed(target: Path, desired_content: str, handle_extra_lines=True):
-    """Write content to file if different, not if it is the same
+def _dedupe_extra_lines(
+    target: Path, desired_content: str, extra_lines: str, drop_duplicates=False
+) -> str:
+    """Report (and optionally drop) extra lines that are already generated
 
-    And create the file if it doesn't exist.
+    Only handy for line-based files like .gitignore. Blank lines and comments are
+    never seen as duplicates.
+    """
+    generated = {line.strip() for line in desired_content.splitlines()}
+    kept = []
+    duplicates = []
+    for line in extra_lines.splitlines(keepends=True):
+        stripped = line.strip()
+        if stripped and not stripped.startswith("#") and stripped in generated:
+            duplicates.append(stripped)
+            if drop_duplicates:
+                continue
+        kept.append(line)
+    if duplicates:
+        action = "dropped" if drop_duplicates else "found"
+        logger.warning(
+            f"{target}: {action} {len(duplicates)} extra line(s) that are already "
+            f"generated: {', '.join(duplicates[:5])}"
+            + (", ..." if len(duplicates) > 5 else "")
+        )
+    return "".join(kept)
 
-    And... look for an end-of-generated-file marker and preserve the contents after
-    it. If `handle_extra_lines` is True (the default).
 
-    And... leave it alone if the marker is there.
+def planned_write(
+    target: Path,
+    desired_content: str,
+    handle_extra_lines=True,
+    fs: filesystem.Filesystem = filesystem.DISK,
+    check_duplicates=False,
+    drop_duplicates=False,
+) -> tuple[Path, str] | None:
+    """Return the target and the content we'd write to it, or None if unchanged
+
+    The target normally is the passed-in target, but it is a `.suggestion` file if
+    the leave-alone marker is found in the existing file.
+
+    And... look for an end-of-generated-file marker and preserve the contents after
+    it. If `handle_extra_lines` is True (the default). With `check_duplicates`, extra
+    lines that duplicate generated lines are reported (and removed if
+    `drop_duplicates` is set).
 
     """
-    existing_content = target.read_text() if target.exists() else ""
+    if handle_extra_lines:
+        # Normally, there are no extra lines.
+        likely_content = desired_content + "\n" + EXTRA_LINES_MARKER
+    else:
+        likely_content = desired_content
+    if fs.known_to_contain(target, likely_content):
+        logger.debug(f"{target} remained the same (according to git)")
+        return None
+
+    existing_content = fs.read_text(target) if fs.exists(target) else ""
     leave_alone = LEAVE_ALONE_MARKER in existing_content
     if handle_extra_lines:
         extra_lines = _extract_extra_lines(existing_content)
+        if check_duplicates:
+            extra_lines = _dedupe_extra_lines(
+                target, desired_content, extra_lines, drop_duplicates
+            )
         extra_lines_marker_with_empty_line_before = "\n" + EXTRA_LINES_MARKER
         new_content = extra_lines_marker_with_empty_line_before.join(
             [desired_content, extra_lines]
@@ -56,27 +110,70 @@ def write_if_changed(target: Path, desired_content: str, handle_extra_lines=True
 
     if new_content == existing_content:
         logger.debug(f"{target} remained the same")
-        return
+        return None
 
     if leave_alone:
         logger.debug(f"Leave-alone marger found in {target}")
         target = target.parent / (target.name + SUGGESTION_SUFFIX)
+    return target, new_content
+
+
+def write_if_changed(
+    target: Path,
+    desired_content: str,
+    handle_extra_lines=True,
+    fs: filesystem.Filesystem = filesystem.DISK,
+    check_duplicates=False,
+    drop_duplicates=False,
+):
+    """Write content to file if different, not if it is the same
+
+    And create the file if it doesn't exist.
 
-    target.write_text(new_content)
+    And... preserve the extra lines and honour the leave-alone marker, see
+    `planned_write()`.
+
+    """
+    planned = planned_write(
+        target,
+        desired_content,
+        handle_extra_lines,
+        fs,
+        check_duplicates=check_duplicates,
+        drop_duplicates=drop_duplicates,
+    )
+    if planned is None:
+        return
+    target, new_content = planned
+    fs.write_text(target, new_content)
     logger.info(f"Wrote {target}")
 
 
-def uses_python(project: Path) -> bool:
+def version_tuple(version: str) -> tuple[int, ...]:
+    """Return the numeric release part of a version, for sorting and comparing
+
+    Good enough for our purposes (minimum versions, our own meta_version).
+    """
+    match = re.match(r"\d+(\.\d+)*", version)
+    if match is None:
+        return ()
+    parts = [int(part) for part in match.group().split(".")]
+    while parts and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+
+def uses_python(project: Path, fs: filesystem.Filesystem = filesystem.DISK) -> bool:
     """Return whether we detect a python project"""
-    if any(project.glob("**/*.py")):
+    if any(fs.rglob(project, "*.py")):
         logger.debug("*.py found, assuming we use python")
         return True
     return False
 
 
-def uses_ansible(project: Path) -> bool:
+def uses_ansible(project: Path, fs: filesystem.Filesystem = filesystem.DISK) -> bool:
     """Return whether we detect an ansible dir"""
-    if (project / "ansible").exists():
+    if fs.exists(project / "ansible"):
         logger.debug("ansible/ dir found, assuming we use ansible")
         return True
     return False